@@ -40,7 +40,8 @@
           };
 
           devShell = mach-nix.mkPythonShell {
-            requirements = builtins.readFile ./requirements.txt;
+            requirements = builtins.readFile ./requirements.txt
+              + builtins.readFile ./requirements-dev.txt;
           };
         }
       );
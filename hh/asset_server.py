@@ -0,0 +1,207 @@
+import gzip
+import hashlib
+from http.server import BaseHTTPRequestHandler
+import mimetypes
+import os
+import threading
+import time
+from urllib.parse import unquote, urlsplit
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# content types worth compressing, anything else is sent as is
+COMPRESSIBLE = (
+    "text/",
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+)
+
+# encodings in order of preference
+ENCODINGS = ("br", "gzip")
+
+
+# a file held in memory together with its compressed variants
+class Asset:
+    def __init__(self, data, mtime, content_type):
+        self.mtime = mtime
+        self.content_type = content_type
+        self.etag = '"' + hashlib.sha1(data).hexdigest()[:20] + '"'
+
+        self.variants = {"identity": data}
+        if content_type.startswith(COMPRESSIBLE):
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(compressed) < len(data):
+                self.variants["gzip"] = compressed
+            if brotli is not None:
+                compressed = brotli.compress(data)
+                if len(compressed) < len(data):
+                    self.variants["br"] = compressed
+
+
+# every file below root loaded into memory, rescanned in the background so that
+# edited files are picked up without a restart. lookups only ever go through
+# the loaded paths, request paths never touch the filesystem.
+class AssetStore:
+    def __init__(self, root, interval=1.0):
+        self.root = root
+        self.interval = interval
+
+        self.assets = {}
+        self.scan()
+
+    def get(self, path):
+        return self.assets.get(path)
+
+    def scan(self):
+        # returns the number of files that were added, changed or removed
+        assets = {}
+        changed = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                full = os.path.join(dirpath, filename)
+                path = os.path.relpath(full, self.root).replace(os.sep, "/")
+                try:
+                    mtime = os.stat(full).st_mtime_ns
+                    asset = self.assets.get(path)
+                    if asset is None or asset.mtime != mtime:
+                        with open(full, "rb") as f:
+                            data = f.read()
+                        content_type = (
+                            mimetypes.guess_type(filename)[0]
+                            or "application/octet-stream"
+                        )
+                        asset = Asset(data, mtime, content_type)
+                        changed += 1
+                except OSError:
+                    continue
+                assets[path] = asset
+
+        changed += len(self.assets.keys() - assets.keys())
+        # swapping the dict is atomic, request threads see either version
+        self.assets = assets
+        return changed
+
+    def watch(self):
+        thread = threading.Thread(target=self._watch, daemon=True)
+        thread.start()
+        return thread
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            self.scan()
+
+
+# serves an AssetStore with etags, content negotiation and single range
+# requests. subclasses set `store` and can handle their own paths before
+# falling back to send_asset.
+class AssetHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    store = None
+
+    # assets are revalidated with their etag on every use
+    cache_control = "no-cache"
+
+    def do_GET(self):
+        self.send_asset()
+
+    def do_HEAD(self):
+        self.send_asset(head=True)
+
+    def send_asset(self, head=False, store=None, path=None, cache_control=None):
+        # sends path from store, both default to the request path in self.store
+        if store is None:
+            store = self.store
+        if path is None:
+            path = unquote(urlsplit(self.path).path).lstrip("/")
+        if path == "" or path.endswith("/"):
+            path += "index.html"
+        if cache_control is None:
+            cache_control = self.cache_control
+        asset = store.get(path)
+        if asset is None:
+            self.send_error(404)
+            return
+
+        if asset.etag in self.headers.get("If-None-Match", ""):
+            self.send_response(304)
+            self.send_asset_headers(asset, cache_control)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        # ranges are only served from the uncompressed data
+        byte_range = self.parse_range(asset)
+        if byte_range is not None:
+            data = asset.variants["identity"]
+            if byte_range == ():
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            start, end = byte_range
+            body = data[start : end + 1]
+            self.send_response(206)
+            self.send_asset_headers(asset, cache_control)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            encoding = self.pick_encoding(asset)
+            body = asset.variants[encoding]
+            self.send_response(200)
+            self.send_asset_headers(asset, cache_control)
+            if encoding != "identity":
+                self.send_header("Content-Encoding", encoding)
+
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def send_asset_headers(self, asset, cache_control):
+        self.send_header("Content-Type", asset.content_type)
+        self.send_header("ETag", asset.etag)
+        self.send_header("Cache-Control", cache_control)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Vary", "Accept-Encoding")
+
+    def pick_encoding(self, asset):
+        accepted = {
+            part.split(";")[0].strip()
+            for part in self.headers.get("Accept-Encoding", "").split(",")
+        }
+        for encoding in ENCODINGS:
+            if encoding in accepted and encoding in asset.variants:
+                return encoding
+        return "identity"
+
+    def parse_range(self, asset):
+        # returns (start, end) of a satisfiable single range, () for an
+        # unsatisfiable one and None when the whole asset should be sent
+        header = self.headers.get("Range")
+        if header is None or not header.startswith("bytes="):
+            return None
+        if_range = self.headers.get("If-Range")
+        if if_range is not None and if_range != asset.etag:
+            return None
+
+        spec = header[len("bytes=") :]
+        if "," in spec:
+            return None
+        first, _, last = spec.strip().partition("-")
+        size = len(asset.variants["identity"])
+        try:
+            if first == "":
+                start, end = max(size - int(last), 0), size - 1
+            else:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+        except ValueError:
+            return None
+        if start > end or start >= size:
+            return ()
+        return start, end
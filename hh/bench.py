@@ -0,0 +1,442 @@
+from argparse import ArgumentParser
+import gc
+from itertools import cycle
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+
+from hh.face_model import MODEL_POINTS
+import hh.face_features
+import hh.head_pose
+import hh.protocol
+import hh.scheduler
+import hh.smoother
+
+# micro benchmarks of the per-frame hot paths, run headless on synthetic faces:
+#
+#   python -m hh.bench                  run everything, save under .benchmarks
+#   python -m hh.bench -k smoother      only benchmarks with "smoother" in name
+#   python -m hh.bench --compare REV    show the change against a saved run
+#
+# every benchmark is a setup function returning the call to time, registered
+# with @benchmark. results are saved as .benchmarks/<commit>.json, so runs of
+# different commits on the same machine can be compared.
+BENCH_DIR = ".benchmarks"
+
+BENCHMARKS = {}
+
+FRAME_SIZE = (320, 240)
+
+# synthetic frames every benchmark cycles through
+NUM_FRAMES = 64
+
+# upper and lower lid landmarks of either eye, paired up
+LIDS = (
+    (159, 145),
+    (158, 153),
+    (160, 144),
+    (157, 154),
+    (161, 163),
+    (386, 374),
+    (385, 380),
+    (387, 373),
+    (384, 381),
+    (388, 390),
+)
+
+# eye corners the iris points of either eye are placed between
+IRIS_EYES = ((33, 133), (362, 263))
+
+# lower inner lip, everything below it moves with the jaw
+LOWER_LIP = 14
+
+
+def rotation(yaw, pitch, roll):
+    cx, cy, cz = np.cos((pitch, yaw, roll))
+    sx, sy, sz = np.sin((pitch, yaw, roll))
+    rx = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+    ry = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+    rz = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+    return rx @ ry @ rz
+
+
+def synthetic_landmarks(rng, frames, faces=1, frame_size=FRAME_SIZE):
+    # face mesh like normalized landmarks of shape (frames, faces, 478, 3): the
+    # face model with a random jaw drop, blink and gaze, turned up to 30
+    # degrees either way, moved around and projected through a pinhole camera
+    # with the focal length of the frame width
+    width, height = frame_size
+    res = np.empty((frames, faces, 478, 3), dtype=np.float32)
+    jaw = MODEL_POINTS[:, 1] <= MODEL_POINTS[LOWER_LIP, 1]
+    for i in range(frames):
+        for j in range(faces):
+            p = MODEL_POINTS.astype(np.float64)
+
+            p[jaw, 1] -= rng.uniform(0.0, 1.5)
+            closed = rng.uniform(0.0, 1.0)
+            for upper, lower in LIDS:
+                p[upper] += (p[lower] - p[upper]) * closed
+
+            iris = []
+            for outer, inner in IRIS_EYES:
+                center = (p[outer] + p[inner]) / 2
+                radius = np.linalg.norm(p[outer] - p[inner]) / 5
+                center[:2] += rng.uniform(-1.0, 1.0, 2) * radius
+                iris.append(center)
+                for dx, dy in ((1, 0), (0, 1), (-1, 0), (0, -1)):
+                    iris.append(center + (dx * radius, dy * radius, 0.0))
+            p = np.concatenate([p, iris])
+
+            p = p @ rotation(*rng.uniform(-np.pi / 6, np.pi / 6, 3)).T
+            distance = rng.uniform(30.0, 60.0)
+            offset = rng.uniform(-0.2, 0.2, 2) * distance
+
+            # camera space has y pointing down and the face looking at it
+            x = p[:, 0] + offset[0]
+            y = -p[:, 1] + offset[1]
+            z = distance - p[:, 2]
+            res[i, j, :, 0] = (width * x / z + width / 2) / width
+            res[i, j, :, 1] = (width * y / z + height / 2) / height
+            res[i, j, :, 2] = (z - distance) / distance
+    return res
+
+
+def wire_faces(rng, faces):
+    # rows of face id and channels like FaceState.wire_values sends
+    res = rng.uniform(-1.0, 1.0, (faces, 1 + hh.protocol.NUM_WIRE_CHANNELS))
+    res[:, 0] = np.arange(faces)
+    return res
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def scalar_smoother(cls):
+    def setup(rng):
+        smoother = cls()
+        values = cycle(np.cumsum(rng.normal(size=1024)).tolist())
+        return lambda: smoother.update(next(values), 1 / 30)
+
+    return setup
+
+
+for cls in (
+    hh.smoother.SmootherKF,
+    hh.smoother.SmootherDEMA,
+    hh.smoother.SmootherTEMA,
+    hh.smoother.SmootherOneEuro,
+):
+    benchmark(f"smoother.{cls.__name__}")(scalar_smoother(cls))
+
+
+def smoother_bank(kind, n):
+    def setup(rng):
+        bank = hh.smoother.SmootherBank(n, kind)
+        values = cycle(np.cumsum(rng.normal(size=(256, n)), axis=0))
+        return lambda: bank.update(next(values), 1 / 30)
+
+    return setup
+
+
+for kind in hh.smoother.SmootherBank.KINDS:
+    for faces in (1, 4):
+        benchmark(f"smoother.SmootherBank[{kind},{faces}]")(
+            smoother_bank(kind, 14 * faces)
+        )
+
+
+@benchmark("scheduler.OutputScheduler")
+def output_scheduler(rng):
+    scheduler = hh.scheduler.OutputScheduler(hh.protocol.NUM_WIRE_CHANNELS)
+    values = cycle(
+        np.cumsum(rng.normal(size=(256, hh.protocol.NUM_WIRE_CHANNELS)), axis=0)
+    )
+    now = [0.0]
+
+    def call():
+        now[0] += 1 / 30
+        faces = np.concatenate(([0.0], next(values)))[None]
+        scheduler.update(faces[0, 1:], faces, now[0], now[0])
+        scheduler.sample(now[0] + 1 / 120)
+
+    return call
+
+
+def feature_method(name):
+    def setup(rng):
+        calc = hh.face_features.FaceFeaturesCalculator(FRAME_SIZE)
+        method = getattr(calc, name)
+        frames = [
+            (norm_lmks[0], norm_lmks[0, :468, :2] * FRAME_SIZE)
+            for norm_lmks in synthetic_landmarks(rng, NUM_FRAMES)
+        ]
+        frames = cycle(frames)
+
+        def call():
+            norm_lmks, lmks = next(frames)
+            method(None, lmks, norm_lmks)
+
+        return call
+
+    return setup
+
+
+for name in ("head", "mouth", "eye"):
+    benchmark(f"features.{name}")(feature_method(name))
+
+
+def feature_batch(faces):
+    def setup(rng):
+        calc = hh.face_features.FaceFeaturesCalculator(FRAME_SIZE)
+        frames = cycle(synthetic_landmarks(rng, NUM_FRAMES, faces))
+        return lambda: calc.batch(next(frames))
+
+    return setup
+
+
+for faces in (1, 4):
+    benchmark(f"features.batch[{faces}]")(feature_batch(faces))
+
+
+@benchmark("features.head_pose")
+def head_pose(rng):
+    calc = hh.face_features.FaceFeaturesCalculator(FRAME_SIZE)
+    solver = hh.head_pose.HeadPoseSolver(FRAME_SIZE)
+    frames = [
+        (norm_lmks, calc.batch(norm_lmks)[0])
+        for norm_lmks in synthetic_landmarks(rng, NUM_FRAMES)
+    ]
+    frames = cycle(frames)
+    slots = np.zeros(1, dtype=int)
+
+    def call():
+        norm_lmks, rotation = next(frames)
+        solver.solve(norm_lmks, slots, rotation)
+
+    return call
+
+
+def landmark_list(norm_lmks, visibility=False):
+    # a NormalizedLandmarkList like face mesh returns, with visibility set the
+    # landmarks no longer fit the fast path
+    from mediapipe.framework.formats import landmark_pb2
+
+    res = landmark_pb2.NormalizedLandmarkList()
+    for x, y, z in norm_lmks.tolist():
+        lmk = res.landmark.add(x=x, y=y, z=z)
+        if visibility:
+            lmk.visibility = 1.0
+    return res
+
+
+def landmark_conversion(visibility):
+    def setup(rng):
+        # face mesh pulls in mediapipe, but no model is loaded
+        import hh.face_mesh
+
+        lists = cycle(
+            [
+                landmark_list(norm_lmks[0], visibility)
+                for norm_lmks in synthetic_landmarks(rng, 8)
+            ]
+        )
+        out = np.zeros((478, 3), dtype=np.float32)
+        return lambda: hh.face_mesh.extract(next(lists), out)
+
+    return setup
+
+
+benchmark("face_mesh.extract")(landmark_conversion(False))
+benchmark("face_mesh.extract[fallback]")(landmark_conversion(True))
+
+
+def encode_json(faces):
+    def setup(rng):
+        rows = cycle([wire_faces(rng, faces) for _ in range(NUM_FRAMES)])
+
+        def call():
+            f = next(rows)
+            hh.protocol.encode_json(f[0, 1:], f)
+
+        return call
+
+    return setup
+
+
+def encode_binary(faces):
+    def setup(rng):
+        rows = cycle([wire_faces(rng, faces) for _ in range(NUM_FRAMES)])
+        return lambda: hh.protocol.encode_binary(next(rows), 1, time.time())
+
+    return setup
+
+
+for faces in (1, 4):
+    benchmark(f"protocol.encode_json[{faces}]")(encode_json(faces))
+    benchmark(f"protocol.encode_binary[{faces}]")(encode_binary(faces))
+
+
+@benchmark("protocol.decode_binary[4]")
+def decode_binary(rng):
+    data = hh.protocol.encode_binary(wire_faces(rng, 4), 1, time.time())
+    return lambda: hh.protocol.decode_binary(data)
+
+
+def measure(call, min_time=0.2, repeat=5):
+    # returns the median and fastest time of a call in seconds and the peak
+    # bytes it allocates. calls are timed in loops long enough for the timer to
+    # not matter, with the garbage collector off like timeit.
+    call()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            call()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeat:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(min_time / repeat / elapsed))
+
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                call()
+            times.append((time.perf_counter() - start) / number)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        call()
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+
+    return {"median": float(np.median(times)), "min": min(times), "alloc": peak}
+
+
+def commit():
+    # short hash of HEAD, marked dirty when tracked files have changes
+    try:
+        rev = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return rev + ("-dirty" if dirty else "")
+
+
+def load(rev):
+    # a saved run by commit or path
+    path = rev if os.path.isfile(rev) else os.path.join(BENCH_DIR, rev + ".json")
+    with open(path) as f:
+        return json.load(f)
+
+
+def format_time(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.2f}us"
+    return f"{seconds * 1e3:.2f}ms"
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog="python -m hh.bench")
+    parser.add_argument(
+        "-k",
+        dest="filter",
+        help="only run benchmarks with this in their name",
+        default="",
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        help="seconds spent timing every benchmark",
+        default=0.2,
+    )
+    parser.add_argument(
+        "--compare",
+        metavar="REV",
+        help="saved run to compare against, a commit or a json file",
+        default=None,
+    )
+    parser.add_argument(
+        "--no-save",
+        action="store_true",
+        help="do not save the results",
+    )
+    args = parser.parse_args(argv)
+
+    baseline = load(args.compare)["results"] if args.compare else {}
+
+    results = {}
+    print(f"{'benchmark':<40}{'median':>12}{'min':>12}{'alloc':>12}{'change':>10}")
+    for name, setup in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        try:
+            call = setup(np.random.default_rng(0))
+        except ImportError as e:
+            print(f"{name:<40}skipped, {e}")
+            continue
+        res = results[name] = measure(call, args.min_time)
+
+        change = ""
+        if name in baseline:
+            change = f"{res['median'] / baseline[name]['median']:.2f}x"
+        print(
+            f"{name:<40}{format_time(res['median']):>12}{format_time(res['min']):>12}"
+            f"{res['alloc']:>11}B{change:>10}"
+        )
+
+    if not args.no_save and results:
+        rev = commit()
+        os.makedirs(BENCH_DIR, exist_ok=True)
+        path = os.path.join(BENCH_DIR, rev + ".json")
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "commit": rev,
+                    "time": time.time(),
+                    "machine": {
+                        "node": platform.node(),
+                        "processor": platform.processor(),
+                        "cpus": os.cpu_count(),
+                        "python": platform.python_version(),
+                        "numpy": np.__version__,
+                    },
+                    "results": results,
+                },
+                f,
+                indent=1,
+            )
+        print(f"saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import numpy as np
+
+# cv2 is imported by the functions that use it, so the capture options can be
+# parsed without loading it
+
+# cv2 capture api preferences
+CAPTURE_BACKENDS = {
+    "auto": "CAP_ANY",
+    "v4l2": "CAP_V4L2",
+    "gstreamer": "CAP_GSTREAMER",
+    "file": "CAP_FFMPEG",
+}
+
+# cv2.flip codes
+FLIPS = {
+    "none": None,
+    "vertical": 0,
+    "horizontal": 1,
+    "both": -1,
+}
+
+
+def parse_size(s):
+    # "640x480" -> (640, 480)
+    width, _, height = s.lower().partition("x")
+    return int(width), int(height)
+
+
+def open_capture(src, backend="auto", fourcc=None, size=None, fps=None):
+    # opens a camera index, device path, gstreamer pipeline or video file. the
+    # format is set before the size and frame rate since many webcams only
+    # offer their larger sizes and higher frame rates as mjpeg.
+    import cv2
+
+    if isinstance(src, str) and src.isdigit():
+        src = int(src)
+    cap = cv2.VideoCapture(src, getattr(cv2, CAPTURE_BACKENDS[backend]))
+    assert cap.isOpened(), f"cannot open capture: {src}"
+
+    # gstreamer pipelines and files bring their own format
+    if backend in ("auto", "v4l2"):
+        if fourcc:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        if size is not None:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, size[0])
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, size[1])
+        if fps:
+            cap.set(cv2.CAP_PROP_FPS, fps)
+    return cap
+
+
+def capture_mode(cap):
+    # returns the format, size and frame rate the capture actually delivers
+    import cv2
+
+    code = int(cap.get(cv2.CAP_PROP_FOURCC))
+    fourcc = "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4))
+    size = (
+        int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+    )
+    return fourcc.strip("\0 ") or "?", size, cap.get(cv2.CAP_PROP_FPS)
+
+
+def scaled_size(size, width):
+    # size scaled down to width, never up
+    if width is None or width >= size[0]:
+        return size
+    return width, round(size[1] * width / size[0])
+
+
+# turns captured bgr frames into the rgb frames mediapipe expects, scaled down
+# and flipped, in one call that writes straight into the destination. the
+# conversion and flip run after scaling so they only touch the smaller frame,
+# and all intermediate frames live in buffers that are reused.
+class Preprocessor:
+    def __init__(self, flip="none"):
+        self.flip = FLIPS[flip]
+        self.scaled = None
+        self.converted = None
+
+    def __call__(self, frame, dst):
+        import cv2
+
+        height, width = dst.shape[:2]
+        if frame.shape[:2] != (height, width):
+            if self.scaled is None or self.scaled.shape != dst.shape:
+                self.scaled = np.empty_like(dst)
+            frame = cv2.resize(
+                frame, (width, height), dst=self.scaled, interpolation=cv2.INTER_AREA
+            )
+
+        if self.flip is None:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=dst)
+            return dst
+
+        if self.converted is None or self.converted.shape != dst.shape:
+            self.converted = np.empty_like(dst)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.converted)
+        cv2.flip(self.converted, self.flip, dst=dst)
+        return dst
@@ -1,10 +1,37 @@
-import math
-
-import cv2
 import numpy as np
 
-from hh.utils import eprint, lerp, norm_angle, remap
-from hh.face_model import ADJ_MODEL_INDICES, MODEL_POINTS
+from hh.utils import lerp, norm_angle, remap
+
+# landmark pairs whose distances the features use, in the order batch unpacks
+# them
+DISTANCE_PAIRS = (
+    # mouth aspect ratio
+    (81, 178),
+    (13, 14),
+    (311, 402),
+    (78, 308),
+    # eye corners and mouth corners
+    (133, 362),
+    (130, 263),
+    (61, 291),
+    # eye widths and heights
+    (133, 33),
+    (263, 362),
+    (145, 159),
+    (374, 386),
+)
+
+# landmarks used as points: the head plane, the inner and outer corners and
+# lower lid of either eye and the iris centers
+POINTS = (21, 251, 397, 172, 133, 33, 159, 263, 362, 386, 468, 473)
+
+# every landmark the features read, gathered with a single fancy index. the
+# first landmark of every pair comes first, then the second ones, then the
+# points, so the pair distances are a difference of two slices.
+GATHER = np.array(
+    [a for a, _ in DISTANCE_PAIRS] + [b for _, b in DISTANCE_PAIRS] + list(POINTS)
+)
+POINTS_START = 2 * len(DISTANCE_PAIRS)
 
 
 class FaceFeaturesCalculator:
@@ -12,16 +39,6 @@ class FaceFeaturesCalculator:
         self.head_rotation = np.zeros((3, 1))
         self.head_translation = np.zeros((3, 1))
 
-        self.camera_matrix = np.array(
-            [
-                [frame_size[1], 0, frame_size[1] / 2],
-                [0, frame_size[1], frame_size[0] / 2],
-                [0, 0, 1],
-            ],
-            dtype=np.float64,
-        )
-        self.dist_co = np.zeros((4, 1), dtype=np.float32)
-
         self.debug = debug
 
     def head(self, frame, lmks, norm_lmks):
@@ -177,3 +194,177 @@ class FaceFeaturesCalculator:
             (right_iris_ratio_x, right_iris_ratio_y),
             (left_eye_ratio, right_eye_ratio),
         )
+
+    # head, mouth and eye of a whole batch of faces in one pass, giving the
+    # same results as the methods above for every face. norm_lmks is stacked
+    # landmarks of shape (..., landmarks, 3), e.g. (faces, 478, 3) or
+    # (frames, faces, 478, 3). returns head rotation, head translation, mouth
+    # ratio, left and right iris ratios and eye ratios, each of shape (..., n).
+    def batch(self, norm_lmks):
+        g = norm_lmks[..., GATHER, :]
+
+        # every distance the features need
+        pairs = len(DISTANCE_PAIRS)
+        delta = g[..., :pairs, :] - g[..., pairs:POINTS_START, :]
+        (
+            mouth_a,
+            mouth_b,
+            mouth_c,
+            mouth_width,
+            eye_inner_corner_dist,
+            eye_outer_corner_dist,
+            mouth_corner_dist,
+            left_eye_width,
+            right_eye_width,
+            left_eye_height,
+            right_eye_height,
+        ) = np.moveaxis(np.linalg.norm(delta, axis=-1), -1, 0)
+        (
+            head_a,
+            head_b,
+            head_c,
+            head_d,
+            left_eye_inner_corner,
+            left_eye_outer_corner,
+            left_eye_lower,
+            right_eye_inner_corner,
+            right_eye_outer_corner,
+            right_eye_lower,
+            left_iris_center,
+            right_iris_center,
+        ) = np.moveaxis(g[..., POINTS_START:, :], -2, 0)
+
+        # head
+        qb = head_b - head_a
+        qc = lerp(head_c, head_d, 0.5) - head_a
+        n = batch_cross(qb, qc)
+
+        unit_z = n / np.linalg.norm(n, axis=-1, keepdims=True)
+        unit_x = qb / np.linalg.norm(qb, axis=-1, keepdims=True)
+        unit_y = batch_cross(unit_z, unit_x)
+        head_rotation = batch_euler(unit_x, unit_y, unit_z)
+
+        head_translation = np.broadcast_to(
+            self.head_translation[:, 0], head_rotation.shape
+        )
+
+        # mouth
+        mouth_aspect_ratio = np.clip(
+            (mouth_a + mouth_b + mouth_c) / (2 * mouth_width + 1e-6), 0.0, 1.0
+        )
+
+        raw_ratio_y = mouth_b / eye_inner_corner_dist
+        raw_ratio_x = mouth_corner_dist / eye_outer_corner_dist
+
+        mouth_ratio = np.stack(
+            [
+                np.clip((batch_remap(raw_ratio_x, 0.35, 0.9) - 0.4) * 2.2, -0.8, 0.8),
+                batch_remap((raw_ratio_y + mouth_aspect_ratio / 2.0), 0.17, 0.8),
+            ],
+            axis=-1,
+        )
+
+        # eyes
+        left_eye_mid = (
+            left_eye_inner_corner + left_eye_outer_corner + left_eye_lower
+        ) / 3.0
+        right_eye_mid = (
+            right_eye_inner_corner + right_eye_outer_corner + right_eye_lower
+        ) / 3.0
+
+        left_iris = left_iris_center[..., :2] - left_eye_mid[..., :2]
+        right_iris = right_iris_center[..., :2] - right_eye_mid[..., :2]
+
+        left_iris_ratio = np.clip(
+            np.stack(
+                [
+                    left_iris[..., 0] / (left_eye_width / 4.0),
+                    left_iris[..., 1] / (left_eye_height / 5.0),
+                ],
+                axis=-1,
+            ),
+            -1.0,
+            1.0,
+        )
+        right_iris_ratio = np.clip(
+            np.stack(
+                [
+                    right_iris[..., 0] / (right_eye_width / 4.0),
+                    right_iris[..., 1] / (right_eye_height / 5.0),
+                ],
+                axis=-1,
+            ),
+            -1.0,
+            1.0,
+        )
+
+        left_eye_ratio = left_eye_width / left_eye_height
+        right_eye_ratio = right_eye_width / right_eye_height
+
+        # an eye that is almost closed follows the other one, otherwise both
+        # are pulled a bit towards each other
+        left_closed = (left_eye_ratio > 3.2)[..., None]
+        right_closed = (right_eye_ratio > 3.2)[..., None]
+        either_closed = left_closed | right_closed
+        closed_iris_ratio = np.where(left_closed, right_iris_ratio, left_iris_ratio)
+        left_iris_ratio, right_iris_ratio = (
+            np.where(
+                either_closed,
+                closed_iris_ratio,
+                lerp(0.2, left_iris_ratio, right_iris_ratio),
+            ),
+            np.where(
+                either_closed,
+                closed_iris_ratio,
+                lerp(0.2, right_iris_ratio, left_iris_ratio),
+            ),
+        )
+
+        eye_ratios = 1.0 - batch_remap(
+            np.stack([left_eye_ratio, right_eye_ratio], axis=-1) / 6, 0.52, 0.62
+        )
+
+        return (
+            head_rotation,
+            head_translation,
+            mouth_ratio,
+            left_iris_ratio,
+            right_iris_ratio,
+            eye_ratios,
+        )
+
+
+def batch_remap(x, m, M):
+    # clamped values come out exactly like remap does
+    return np.where(x <= m, 0.0, np.where(x >= M, 1.0, (x - m) / (M - m)))
+
+
+def batch_euler(unit_x, unit_y, unit_z):
+    # head rotation in degrees from the axes of the head plane, as pitch, yaw
+    # and roll with the pitch turned around to face the camera
+    beta = np.arcsin(unit_z[..., 0])
+    alpha = np.arctan2(-unit_z[..., 1], -unit_z[..., 2])
+    gamma = np.arctan2(-unit_y[..., 0], unit_x[..., 0])
+
+    euler = np.stack(
+        [batch_norm_angle(alpha), batch_norm_angle(-beta), batch_norm_angle(gamma)],
+        axis=-1,
+    )
+    euler *= 180
+
+    euler[..., 0] += 180
+    euler[..., 0] = np.where(euler[..., 0] > 180, euler[..., 0] - 360, euler[..., 0])
+    return euler
+
+
+def batch_cross(a, b):
+    # same arithmetic as np.cross without its setup cost on small batches
+    a0, a1, a2 = a[..., 0], a[..., 1], a[..., 2]
+    b0, b1, b2 = b[..., 0], b[..., 1], b[..., 2]
+    return np.stack([a1 * b2 - a2 * b1, a2 * b0 - a0 * b2, a0 * b1 - a1 * b0], axis=-1)
+
+
+def batch_norm_angle(x):
+    a = x % (2 * np.pi)
+    a = np.where(a > np.pi, a - 2 * np.pi, a)
+    return a / np.pi
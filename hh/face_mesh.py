@@ -1,52 +1,275 @@
-import mediapipe as mp
+from functools import lru_cache
+
+import cv2
 import numpy as np
 
+# number of face mesh points without the iris points
+NUM_HEAD_LANDMARKS = 468
+
+# number of face mesh points with the refined iris points
+NUM_LANDMARKS = 478
+
+# first iris point and the eye corners of either iris, unrefined results get
+# their iris points put in the middle of the eye
+IRIS_EYES = ((468, (33, 133)), (473, (362, 263)))
+
+# a serialized NormalizedLandmarkList is a run of length delimited landmark
+# messages. as long as only x, y and z are set every landmark takes exactly 17
+# bytes (field header, length and three tagged floats), so the whole list can
+# be read straight out of the serialized bytes without touching each landmark
+# from python.
+LANDMARK_RECORD = np.dtype(
+    {
+        "names": ["x", "y", "z"],
+        "formats": ["<f4", "<f4", "<f4"],
+        "offsets": [3, 8, 13],
+        "itemsize": 17,
+    }
+)
+LANDMARK_HEADER_OFFSETS = [0, 1, 2, 7, 12]
+LANDMARK_HEADER = np.array([0x0A, 0x0F, 0x0D, 0x15, 0x1D], dtype=np.uint8)
+
+
+# mediapipe takes long to import, so it is only imported once a face mesh is
+# made or its contours are drawn
+@lru_cache(maxsize=None)
+def face_contours():
+    # (start, end) landmark index pairs of the face contour lines
+    import mediapipe as mp
 
+    return sorted(mp.solutions.face_mesh.FACEMESH_CONTOURS)
+
+
+# size of the grayscale thumbnails compared by the motion check
+MOTION_SIZE = (32, 24)
+
+
+# runs face mesh on a frame and converts the results into landmark arrays.
+#
+# with roi enabled only a padded box around the faces found in the previous
+# frame is handed to mediapipe. the box is kept as long as the faces stay well
+# inside of it, so mediapipe keeps tracking in the same image coordinates, and
+# the full frame is used again as soon as a face is lost. faces entering the
+# frame outside of the box are only picked up after such a fallback.
+#
+# with a motion threshold inference is skipped entirely while the frame differs
+# from the last inferred one by less than that many gray levels on average, the
+# last landmarks are returned instead.
+#
+# scale, refine and stride can be changed between frames to trade accuracy for
+# time: frames are scaled down by scale before inference, with refine off a
+# second face mesh without iris refinement is used and only every stride-th
+# frame is inferred, the others return the last landmarks like skipped frames.
+# the unrefined face mesh has its own tracking state, so switching between the
+# two costs a detection.
 class FaceMeshDetector:
-    def __init__(self, min_detection=0.5, min_tracking=0.5, debug=0):
-        self.mp_face_mesh = mp.solutions.face_mesh.FaceMesh(
+    def __init__(
+        self,
+        min_detection=0.5,
+        min_tracking=0.5,
+        max_faces=1,
+        roi=False,
+        roi_padding=0.5,
+        motion_threshold=0.0,
+    ):
+        self.min_detection = min_detection
+        self.min_tracking = min_tracking
+
+        # refine_landmarks -> face mesh, the unrefined one is made on first use
+        self.meshes = {True: self.make_mesh(max_faces, True)}
+        self.refine = True
+        self.scale = 1.0
+        self.stride = 1
+        self.frame_index = 0
+
+        # landmark buffers are reused every frame, callers must copy them if
+        # they need to keep them past the next call to run
+        self.max_faces = max_faces
+        self.lmks = np.zeros((max_faces, NUM_HEAD_LANDMARKS, 2), dtype=np.float32)
+        self.norm_lmks = np.zeros((max_faces, 0, 3), dtype=np.float32)
+        self.num_faces = 0
+
+        # (x0, y0, x1, y1) pixel box around the faces of the last inference
+        self.roi = roi
+        self.roi_padding = roi_padding
+        self.box = None
+
+        self.motion_threshold = motion_threshold
+        self.thumbnail = None
+
+        # frames that skipped inference, frames where the box lost a face and
+        # frames left out by the stride
+        self.skipped = 0
+        self.fallbacks = 0
+        self.strided = 0
+
+    def make_mesh(self, max_faces, refine):
+        import mediapipe as mp
+
+        return mp.solutions.face_mesh.FaceMesh(
             static_image_mode=False,
-            max_num_faces=1,
-            refine_landmarks=True,
-            min_detection_confidence=min_detection,
-            min_tracking_confidence=min_tracking,
+            max_num_faces=max_faces,
+            refine_landmarks=refine,
+            min_detection_confidence=self.min_detection,
+            min_tracking_confidence=self.min_tracking,
         )
 
-        if debug > 0:
-            self.drawing_spec = mp.solutions.drawing_utils.DrawingSpec(
-                thickness=1, circle_radius=1
-            )
+    # returns the landmarks of every detected face stacked into arrays of shape
+    # (faces, landmarks, 2) in pixels and (faces, landmarks, 3) normalized
+    def run(self, frame):
+        self.frame_index += 1
+        if self.stride > 1 and self.frame_index % self.stride != 0:
+            self.strided += 1
+            return self.last_result(frame)
 
-        self.debug = debug
+        if self.motion_threshold > 0:
+            thumbnail = cv2.resize(
+                cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY),
+                MOTION_SIZE,
+                interpolation=cv2.INTER_AREA,
+            )
+            if (
+                self.thumbnail is not None
+                and cv2.absdiff(thumbnail, self.thumbnail).mean()
+                < self.motion_threshold
+            ):
+                self.skipped += 1
+                return self.last_result(frame)
+            self.thumbnail = thumbnail
 
-    def run(self, frame):
         frame.flags.writeable = False
-        res = self.mp_face_mesh.process(frame)
-
-        if res.multi_face_landmarks is not None:
-            if self.debug > 0:
-                mp.solutions.drawing_utils.draw_landmarks(
-                    image=frame,
-                    landmark_list=res.multi_face_landmarks[0],
-                    connections=mp.solutions.face_mesh.FACEMESH_CONTOURS,
-                    landmark_drawing_spec=self.drawing_spec,
-                    connection_drawing_spec=self.drawing_spec,
-                )
-
-            lmks = []
-            norm_lmks = []
-            for i, lmk in enumerate(res.multi_face_landmarks[0].landmark):
-                # only add scaled head points without iris points
-                if i < 468:
-                    x, y = int(lmk.x * frame.shape[1]), int(lmk.y * frame.shape[0])
-                    lmks.append((x, y))
-                # add all points
-                norm_lmks.append((lmk.x, lmk.y, lmk.z))
-
-            return (
-                frame,
-                np.array(lmks, dtype=np.float32),
-                np.array(norm_lmks, dtype=np.float32),
-            )
+        if self.box is None:
+            faces = self.process(frame, None)
         else:
+            faces = self.process(frame, self.box)
+            if faces < self.num_faces or faces == 0:
+                self.fallbacks += 1
+                faces = self.process(frame, None)
+
+        self.num_faces = faces
+        if faces == 0:
+            self.box = None
             return frame, None, None
+
+        norm_lmks = self.norm_lmks[: self.num_faces]
+        lmks = self.lmks[: self.num_faces]
+
+        # only scale head points without iris points
+        np.multiply(
+            norm_lmks[:, :NUM_HEAD_LANDMARKS, :2],
+            (frame.shape[1], frame.shape[0]),
+            out=lmks,
+        )
+        np.trunc(lmks, out=lmks)
+
+        if self.roi:
+            self.update_box(lmks, frame.shape)
+
+        return frame, lmks, norm_lmks
+
+    def last_result(self, frame):
+        if self.num_faces == 0:
+            return frame, None, None
+        return frame, self.lmks[: self.num_faces], self.norm_lmks[: self.num_faces]
+
+    def process(self, frame, box):
+        # runs mediapipe on the frame or the box inside of it and extracts the
+        # landmarks into the buffers, normalized to the full frame. returns the
+        # number of faces found
+        image = frame
+        if box is not None:
+            x0, y0, x1, y1 = box
+            image = frame[y0:y1, x0:x1]
+        if self.scale < 1.0:
+            # landmarks are normalized to the image, scaling does not move them
+            image = cv2.resize(
+                image,
+                None,
+                fx=self.scale,
+                fy=self.scale,
+                interpolation=cv2.INTER_AREA,
+            )
+
+        mesh = self.meshes.get(self.refine)
+        if mesh is None:
+            mesh = self.make_mesh(self.max_faces, self.refine)
+            self.meshes[self.refine] = mesh
+        res = mesh.process(np.ascontiguousarray(image))
+
+        if res.multi_face_landmarks is None:
+            return 0
+        faces = res.multi_face_landmarks[: self.max_faces]
+
+        # the buffers always hold the iris points so the landmark layout does
+        # not change with refine
+        n = len(faces[0].landmark)
+        if self.norm_lmks.shape[1] != max(n, NUM_LANDMARKS):
+            self.norm_lmks = np.zeros(
+                (self.max_faces, max(n, NUM_LANDMARKS), 3), dtype=np.float32
+            )
+
+        for i, landmark_list in enumerate(faces):
+            extract(landmark_list, self.norm_lmks[i, :n])
+        if n < NUM_LANDMARKS:
+            for iris, corners in IRIS_EYES:
+                self.norm_lmks[: len(faces), iris : iris + 5] = self.norm_lmks[
+                    : len(faces), corners
+                ].mean(axis=1, keepdims=True)
+
+        norm_lmks = self.norm_lmks[: len(faces)]
+        if box is not None:
+            # z shares the scale of x
+            height, width = frame.shape[:2]
+            scale = ((x1 - x0) / width, (y1 - y0) / height, (x1 - x0) / width)
+            norm_lmks *= scale
+            norm_lmks[:, :, :2] += (x0 / width, y0 / height)
+
+        return len(faces)
+
+    def update_box(self, lmks, shape):
+        lo = lmks.min(axis=(0, 1))
+        hi = lmks.max(axis=(0, 1))
+
+        # keep the current box while the faces stay at least half the padding
+        # away from its edges, edges clipped to the frame are not checked
+        if self.box is not None:
+            x0, y0, x1, y1 = self.box
+            frame_hi = np.array((shape[1], shape[0]))
+            box_lo = np.array((x0, y0))
+            box_hi = np.array((x1, y1))
+            margin = (
+                (box_hi - box_lo).max()
+                * self.roi_padding
+                / (1 + 2 * self.roi_padding)
+                / 2
+            )
+            inner_lo = np.where(box_lo > 0, box_lo + margin, 0)
+            inner_hi = np.where(box_hi < frame_hi, box_hi - margin, frame_hi)
+            if (lo >= inner_lo).all() and (hi <= inner_hi).all():
+                return
+
+        pad = (hi - lo).max() * self.roi_padding
+        x0, y0 = np.maximum(lo - pad, 0).astype(int).tolist()
+        x1 = int(min(hi[0] + pad, shape[1]))
+        y1 = int(min(hi[1] + pad, shape[0]))
+        self.box = (x0, y0, x1, y1)
+
+
+def extract(landmark_list, out):
+    # reads the x, y and z of every landmark of a NormalizedLandmarkList into out
+    n = len(out)
+
+    data = landmark_list.SerializeToString()
+    if len(data) == n * LANDMARK_RECORD.itemsize:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(n, -1)
+        if (raw[:, LANDMARK_HEADER_OFFSETS] == LANDMARK_HEADER).all():
+            records = raw.view(LANDMARK_RECORD).reshape(n)
+            out[:, 0] = records["x"]
+            out[:, 1] = records["y"]
+            out[:, 2] = records["z"]
+            return out
+
+    # landmarks carry extra fields, fall back to reading them one by one
+    for i, lmk in enumerate(landmark_list.landmark):
+        out[i] = (lmk.x, lmk.y, lmk.z)
+    return out
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+# gives detected faces ids that stay the same across frames by matching every
+# detection to the closest face seen in the previous frames. each tracked face
+# owns one of `max_faces` slots which index its per face state (smoothers and
+# such) and a face is forgotten after it went missing for `max_missed` frames.
+class FaceTracker:
+    def __init__(self, max_faces=1, max_missed=15, max_distance=0.2):
+        self.max_faces = max_faces
+        self.max_missed = max_missed
+        self.max_distance = max_distance
+
+        # id of the face in every slot, -1 if the slot is free
+        self.ids = np.full(max_faces, -1)
+        self.centers = np.zeros((max_faces, 2))
+        self.missed = np.zeros(max_faces, dtype=np.int64)
+
+        self.next_id = 0
+
+    def active(self):
+        return np.flatnonzero(self.ids >= 0)
+
+    def update(self, centers):
+        # takes the (faces, 2) normalized centers of this frame's detections and
+        # returns the slot of every detection plus the slots that were newly
+        # assigned and need their state reset
+        n = len(centers)
+        slots = np.full(n, -1)
+
+        active = self.active()
+        if n > 0 and len(active) > 0:
+            dists = np.linalg.norm(
+                centers[:, None, :] - self.centers[None, active, :], axis=-1
+            )
+
+            # greedily match the closest pairs first
+            for i in np.argsort(dists, axis=None):
+                d, a = np.unravel_index(i, dists.shape)
+                if dists[d, a] > self.max_distance:
+                    break
+                if slots[d] >= 0 or active[a] in slots:
+                    continue
+                slots[d] = active[a]
+
+        # unmatched detections get a free slot, or once all are taken the slot
+        # of the face that has been missing the longest. otherwise a face that
+        # moved far while it was occluded would not be tracked again until its
+        # old slot is forgotten.
+        new_slots = []
+        for d in np.flatnonzero(slots < 0):
+            unused = ~np.isin(np.arange(self.max_faces), slots)
+            free = np.flatnonzero((self.ids < 0) & unused)
+            if len(free) > 0:
+                slot = free[0]
+            else:
+                stale = np.flatnonzero(unused)
+                if len(stale) == 0:
+                    break
+                slot = stale[np.argmax(self.missed[stale])]
+            slots[d] = slot
+            self.ids[slot] = self.next_id
+            self.next_id += 1
+            new_slots.append(slot)
+
+        matched = slots >= 0
+        self.centers[slots[matched]] = centers[matched]
+        self.missed[slots[matched]] = 0
+
+        # forget faces that have been missing for too long
+        unmatched = np.setdiff1d(active, slots)
+        self.missed[unmatched] += 1
+        self.ids[unmatched[self.missed[unmatched] > self.max_missed]] = -1
+
+        return slots, np.array(new_slots, dtype=np.int64)
@@ -0,0 +1,118 @@
+from multiprocessing import Condition, Value, shared_memory
+import queue
+
+import numpy as np
+
+
+# fixed-slot ring of frames living in shared memory. producers claim a slot and
+# write into it in place, then send only the slot index over a queue so that
+# consumers can read the frame as a numpy view without any pickling or copying.
+#
+# there is no locking, the ring must have more slots than the queue carrying
+# its indices can hold plus the slots being written and read at any one time.
+# the consumer marks the slot it is reading with `hold` and the producer never
+# claims that slot, which is enough when a LatestFrame carries the indices.
+class FrameRing:
+    def __init__(self, shape, dtype=np.uint8, slots=8):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+
+        slot_size = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.frames_size = slot_size * slots
+        # the held slot index lives right after the frames
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=self.frames_size + np.dtype(np.int64).itemsize
+        )
+        self.owner = True
+
+        self.next = 0
+
+        self._attach()
+        self.held[0] = -1
+
+    def _attach(self):
+        self.frames = np.ndarray(
+            (self.slots, *self.shape), dtype=self.dtype, buffer=self.shm.buf
+        )
+        self.held = np.ndarray(
+            (1,), dtype=np.int64, buffer=self.shm.buf, offset=self.frames_size
+        )
+
+    def __getstate__(self):
+        # the shared memory block is reattached by name on unpickle
+        state = self.__dict__.copy()
+        del state["frames"]
+        del state["held"]
+        state["owner"] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._attach()
+
+    def __getitem__(self, slot):
+        return self.frames[slot]
+
+    def hold(self, slot):
+        self.held[0] = slot
+        return self.frames[slot]
+
+    def claim(self):
+        slot = self.next
+        if slot == self.held[0]:
+            slot = (slot + 1) % self.slots
+        self.next = (slot + 1) % self.slots
+        return slot, self.frames[slot]
+
+    def write(self, frame):
+        slot, view = self.claim()
+        if frame.shape == self.shape:
+            np.copyto(view, frame)
+        else:
+            import cv2
+
+            cv2.resize(frame, (self.shape[1], self.shape[0]), dst=view)
+        return slot
+
+    def close(self):
+        del self.frames
+        del self.held
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# single producer, single consumer mailbox that only keeps the newest
+# (slot, timestamp) pair. it quacks like the queue it replaces so the producer
+# never blocks and the consumer always gets the freshest frame, older frames
+# are overwritten and counted in `dropped`.
+class LatestFrame:
+    def __init__(self):
+        self.cond = Condition()
+        self.seq = Value("Q", 0, lock=False)
+        self.slot = Value("i", -1, lock=False)
+        self.timestamp = Value("d", 0.0, lock=False)
+        self.dropped = Value("Q", 0, lock=False)
+
+        # only used on the consumer side
+        self.last_seq = 0
+
+    def full(self):
+        return False
+
+    def put_nowait(self, item):
+        with self.cond:
+            self.slot.value, self.timestamp.value = item
+            self.seq.value += 1
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.seq.value != self.last_seq, timeout):
+                raise queue.Empty
+
+            # frames published since the last get were never consumed
+            self.dropped.value += self.seq.value - self.last_seq - 1
+            self.last_seq = self.seq.value
+            return self.slot.value, self.timestamp.value
@@ -0,0 +1,118 @@
+import cv2
+import numpy as np
+
+from hh.face_features import batch_euler
+from hh.face_model import ADJ_MODEL_INDICES, ADJ_MODEL_POINTS, MODEL_POINTS
+
+
+def plane_axes():
+    # unit x, y and z axes of the head plane the landmark based estimate uses,
+    # in model coordinates
+    qb = MODEL_POINTS[251] - MODEL_POINTS[21]
+    qc = (MODEL_POINTS[397] + MODEL_POINTS[172]) / 2 - MODEL_POINTS[21]
+    n = np.cross(qb, qc)
+
+    unit_z = n / np.linalg.norm(n)
+    unit_x = qb / np.linalg.norm(qb)
+    unit_y = np.cross(unit_z, unit_x)
+    return np.stack([unit_x, unit_y, unit_z]).astype(np.float64)
+
+
+PLANE_AXES = plane_axes()
+
+
+# head pose of every tracked face solved with solvePnP against the canonical
+# face model, which unlike the plane estimate also gives the head translation.
+# sqpnp finds the global minimum directly and is cheaper than even a couple of
+# levenberg-marquardt iterations warm started from the last frame, so every
+# frame is solved from scratch. faces whose solve fails or does not fit the
+# landmarks keep the last solved rotation and translation of their slot, and
+# only faces that were never solved fall back to the plane estimate.
+#
+# the rotation is given as pitch, yaw and roll of the plane axes like the plane
+# estimate does, but the two do not agree: the plane estimate mixes landmarks
+# normalized by width and height and does not use the true midpoint of the jaw,
+# so they differ by a few degrees at the front and more when the head is
+# turned. rotation offsets tuned for one need retuning for the other.
+class HeadPoseSolver:
+    def __init__(self, frame_size, max_faces=1, max_error=0.02):
+        self.frame_size = np.array(frame_size, dtype=np.float64)
+
+        # solves whose rms reprojection error is above this fraction of the
+        # frame width are thrown away
+        self.max_error = max_error
+
+        self.camera_matrix = np.array(
+            [
+                [frame_size[0], 0, frame_size[0] / 2],
+                [0, frame_size[0], frame_size[1] / 2],
+                [0, 0, 1],
+            ],
+            dtype=np.float64,
+        )
+        self.dist_co = np.zeros((4, 1), dtype=np.float64)
+
+        # last solved pose of every slot and whether there is one
+        self.rotations = np.zeros((max_faces, 3))
+        self.translations = np.zeros((max_faces, 3))
+        self.solved = np.zeros(max_faces, dtype=bool)
+
+        # number of faces that fell back to the plane estimate
+        self.fallbacks = 0
+
+    def reset(self, slot):
+        self.rotations[slot] = 0.0
+        self.translations[slot] = 0.0
+        self.solved[slot] = False
+
+    def solve(self, norm_lmks, slots, rotation):
+        # returns the rotation and translation of every face in norm_lmks,
+        # rotation is the plane estimate of every face used for slots that
+        # were never solved
+        slots = np.asarray(slots)
+        rotation = np.array(rotation, dtype=np.float64)
+        translation = np.empty((len(slots), 3))
+        # solvePnP wants every face's points contiguous
+        image_points = np.ascontiguousarray(
+            norm_lmks[:, ADJ_MODEL_INDICES, :2] * self.frame_size, dtype=np.float64
+        )
+
+        solved = np.zeros(len(slots), dtype=bool)
+        matrices = np.empty((len(slots), 3, 3))
+        for i, slot in enumerate(slots):
+            ok, rvec, tvec = cv2.solvePnP(
+                ADJ_MODEL_POINTS,
+                image_points[i],
+                self.camera_matrix,
+                self.dist_co,
+                flags=cv2.SOLVEPNP_SQPNP,
+            )
+            if ok and self.fits(rvec, tvec, image_points[i]):
+                solved[i] = True
+                matrices[i] = cv2.Rodrigues(rvec)[0]
+                self.translations[slot] = tvec[:, 0]
+            else:
+                self.fallbacks += 1
+            translation[i] = self.translations[slot]
+
+        if solved.any():
+            # the plane axes turned into the camera, which looks along the
+            # same axes as the landmarks
+            axes = np.einsum("fij,aj->afi", matrices[solved], PLANE_AXES)
+            solved_slots = slots[solved]
+            self.rotations[solved_slots] = batch_euler(*axes)
+            self.solved[solved_slots] = True
+
+        held = self.solved[slots]
+        rotation[held] = self.rotations[slots[held]]
+
+        return rotation, translation
+
+    def fits(self, rvec, tvec, image_points):
+        if tvec[2, 0] <= 0:
+            return False
+        projected, _ = cv2.projectPoints(
+            ADJ_MODEL_POINTS, rvec, tvec, self.camera_matrix, self.dist_co
+        )
+        error = np.sqrt(np.mean(np.sum((projected[:, 0] - image_points) ** 2, axis=1)))
+        return error <= self.max_error * self.frame_size[0]
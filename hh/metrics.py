@@ -0,0 +1,195 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from multiprocessing.sharedctypes import RawArray
+import sys
+import time
+
+import numpy as np
+
+# pipeline stages that are timed, in the order they run
+STAGES = (
+    "capture",
+    "queue_wait",
+    "face_mesh",
+    "features",
+    "head_pose",
+    "smoothing",
+    "serialization",
+    "send",
+    "total",
+)
+
+# frames seen and dropped, only ever counted up
+COUNTERS = (
+    "frames",
+    "capture_dropped",
+    "stale_dropped",
+    "output_dropped",
+    "client_dropped",
+)
+
+# values the stages set from state they keep themselves: running totals that
+# start over with the stage, and the current quality level
+GAUGES = (
+    "superseded_dropped",
+    "motion_skipped",
+    "roi_fallbacks",
+    "head_pose_fallbacks",
+    "stride_skipped",
+    "quality_level",
+    "quality_changes",
+)
+
+# histogram bucket upper bounds in seconds, log spaced from 10us to 10s
+BOUNDS = np.geomspace(1e-5, 10.0, 41).tolist()
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+# latency histograms, counters and gauges living in shared memory so that every
+# pipeline process can record into them and the server process can report
+# them. every stage, counter and gauge must only be written by a single
+# process, the updates are not locked.
+class Metrics:
+    def __init__(self, stages=STAGES, counters=COUNTERS, gauges=GAUGES):
+        self.stages = stages
+        self.counters = counters
+        self.gauges = gauges
+
+        # per stage: one count per bucket plus +Inf, then the sum
+        self.stride = len(BOUNDS) + 2
+        self.stage_offsets = {s: i * self.stride for i, s in enumerate(stages)}
+        base = len(stages) * self.stride
+        self.counter_offsets = {c: base + i for i, c in enumerate(counters)}
+        base += len(counters)
+        self.gauge_offsets = {g: base + i for i, g in enumerate(gauges)}
+
+        self.data = RawArray("d", base + len(gauges))
+
+    def observe(self, stage, seconds):
+        offset = self.stage_offsets[stage]
+        self.data[offset + bisect_left(BOUNDS, seconds)] += 1
+        self.data[offset + self.stride - 1] += seconds
+
+    def count(self, counter, n=1):
+        self.data[self.counter_offsets[counter]] += n
+
+    def set(self, gauge, value):
+        self.data[self.gauge_offsets[gauge]] = value
+
+    def histogram(self, stage):
+        offset = self.stage_offsets[stage]
+        data = np.frombuffer(self.data, dtype=np.float64)
+        buckets = data[offset : offset + self.stride - 1].copy()
+        return buckets, data[offset + self.stride - 1]
+
+    def snapshot(self):
+        stages = {}
+        for stage in self.stages:
+            buckets, total = self.histogram(stage)
+            n = int(buckets.sum())
+            stages[stage] = {
+                "count": n,
+                "mean": float(total / n) if n > 0 else 0.0,
+                **{f"p{int(q * 100)}": quantile(buckets, q) for q in QUANTILES},
+            }
+
+        counters = {
+            c: int(self.data[offset]) for c, offset in self.counter_offsets.items()
+        }
+        gauges = {g: int(self.data[offset]) for g, offset in self.gauge_offsets.items()}
+
+        return {"stages": stages, "counters": counters, "gauges": gauges}
+
+    def prometheus(self):
+        lines = [
+            "# HELP hoshihoshi_stage_seconds time spent in each pipeline stage",
+            "# TYPE hoshihoshi_stage_seconds histogram",
+        ]
+        for stage in self.stages:
+            buckets, total = self.histogram(stage)
+            cumulative = np.cumsum(buckets)
+            for bound, n in zip(BOUNDS, cumulative):
+                lines.append(
+                    f'hoshihoshi_stage_seconds_bucket{{stage="{stage}",le="{bound:.6g}"}}'
+                    f" {int(n)}"
+                )
+            lines.append(
+                f'hoshihoshi_stage_seconds_bucket{{stage="{stage}",le="+Inf"}}'
+                f" {int(cumulative[-1])}"
+            )
+            lines.append(f'hoshihoshi_stage_seconds_sum{{stage="{stage}"}} {total}')
+            lines.append(
+                f'hoshihoshi_stage_seconds_count{{stage="{stage}"}} {int(cumulative[-1])}'
+            )
+
+        lines += [
+            "# HELP hoshihoshi_stage_quantile_seconds estimated stage latency quantiles",
+            "# TYPE hoshihoshi_stage_quantile_seconds gauge",
+        ]
+        for stage in self.stages:
+            buckets, _ = self.histogram(stage)
+            for q in QUANTILES:
+                lines.append(
+                    f'hoshihoshi_stage_quantile_seconds{{stage="{stage}",quantile="{q}"}}'
+                    f" {quantile(buckets, q)}"
+                )
+
+        lines += [
+            "# HELP hoshihoshi_frames_total frames seen and dropped by the pipeline",
+            "# TYPE hoshihoshi_frames_total counter",
+        ]
+        for c, offset in self.counter_offsets.items():
+            lines.append(
+                f'hoshihoshi_frames_total{{counter="{c}"}} {int(self.data[offset])}'
+            )
+
+        lines += [
+            "# HELP hoshihoshi_state state reported by the stages, totals in here "
+            "start over with their stage",
+            "# TYPE hoshihoshi_state gauge",
+        ]
+        for g, offset in self.gauge_offsets.items():
+            lines.append(f'hoshihoshi_state{{name="{g}"}} {int(self.data[offset])}')
+
+        return "\n".join(lines) + "\n"
+
+
+def quantile(buckets, q):
+    # linear interpolation inside the bucket the quantile falls into
+    n = buckets.sum()
+    if n == 0:
+        return 0.0
+
+    cumulative = np.cumsum(buckets)
+    target = q * n
+    i = int(np.searchsorted(cumulative, target))
+    lower = BOUNDS[i - 1] if i > 0 else 0.0
+    upper = BOUNDS[min(i, len(BOUNDS) - 1)]
+    prev = cumulative[i - 1] if i > 0 else 0.0
+    return float(lower + (upper - lower) * (target - prev) / buckets[i])
+
+
+# prints how long each phase of startup took and when it was done, counted from
+# start. picklable, so stages in other processes report against the same start.
+class StartupProfile:
+    def __init__(self, start, enabled=True):
+        self.start = start
+        self.enabled = enabled
+
+    @contextmanager
+    def phase(self, name):
+        t = time.time()
+        yield
+        self.done(name, t)
+
+    def done(self, name, since=None):
+        # reports a phase that started at since, or just a point in time
+        if not self.enabled:
+            return
+        now = time.time()
+        took = f"{(now - since) * 1000:8.1f}ms" if since is not None else " " * 10
+        # written in one go, stages in other processes report at the same time
+        sys.stderr.write(
+            f"startup: {name:<16} {took}  at {(now - self.start) * 1000:8.1f}ms\n"
+        )
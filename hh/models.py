@@ -0,0 +1,223 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from urllib.parse import quote
+import zipfile
+
+import hh.asset_server
+
+# model entry files, cubism 4 first
+MODEL_SUFFIXES = (".model3.json", ".model.json")
+
+# written next to the extracted files of every model
+META_FILE = ".hoshihoshi.json"
+
+# limits on what a model zip may extract to, since every extracted model is
+# also held in memory with its compressed copies once it is served
+MAX_EXTRACTED_SIZE = 512 << 20
+MAX_MODEL_FILES = 4096
+
+# limits on the models kept extracted on disk and loaded in memory, the least
+# recently used ones are evicted beyond that
+MAX_CACHED_MODELS = 32
+MAX_CACHED_SIZE = 2 << 30
+MAX_LOADED_MODELS = 4
+MAX_LOADED_SIZE = 1 << 30
+
+
+# live2d model zips extracted once into a cache directory named after the hash
+# of the zip, so the extracted files never change and can be cached by the
+# browser for good. extracted models are loaded into memory on first use. both
+# the cache and the loaded models are bounded in count and size, the least
+# recently used models go first. the mtime of a model's meta file is when it
+# was last used.
+class ModelRegistry:
+    def __init__(
+        self,
+        cache_dir,
+        max_models=MAX_CACHED_MODELS,
+        max_size=MAX_CACHED_SIZE,
+        max_loaded=MAX_LOADED_MODELS,
+        max_loaded_size=MAX_LOADED_SIZE,
+    ):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.max_models = max_models
+        self.max_size = max_size
+        self.max_loaded = max_loaded
+        self.max_loaded_size = max_loaded_size
+
+        self.lock = threading.Lock()
+        # key -> (AssetStore, bytes held), least recently used first
+        self.stores = OrderedDict()
+
+    def list(self):
+        models = []
+        for key in sorted(os.listdir(self.cache_dir)):
+            meta = self.meta(key)
+            if meta is not None:
+                models.append(meta)
+        return models
+
+    def meta(self, key):
+        # keys come from request paths, only ever look at plain directory names
+        if not key.isalnum():
+            return None
+        try:
+            with open(os.path.join(self.cache_dir, key, META_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def add(self, f, size, name="model.zip"):
+        # reads a zip of size bytes from f and returns the meta of the model
+        with tempfile.TemporaryDirectory(dir=self.cache_dir) as tmp:
+            digest = hashlib.sha256()
+            path = os.path.join(tmp, "model.zip")
+            with open(path, "wb") as out:
+                remaining = size
+                while remaining > 0:
+                    chunk = f.read(min(remaining, 1 << 20))
+                    if not chunk:
+                        raise ValueError("truncated upload")
+                    digest.update(chunk)
+                    out.write(chunk)
+                    remaining -= len(chunk)
+
+            key = digest.hexdigest()[:16]
+            with self.lock:
+                meta = self.meta(key)
+                if meta is not None:
+                    self.touch(key)
+                    return meta
+
+                extracted = os.path.join(tmp, key)
+                model, extracted_size = extract(path, extracted)
+                meta = {
+                    "id": key,
+                    "name": name,
+                    "url": f"/models/{key}/{quote(model)}",
+                    "size": extracted_size,
+                }
+                with open(os.path.join(extracted, META_FILE), "w") as out:
+                    json.dump(meta, out)
+
+                # the model only shows up once it is completely extracted
+                target = os.path.join(self.cache_dir, key)
+                shutil.rmtree(target, ignore_errors=True)
+                os.rename(extracted, target)
+                self.evict_cached(keep=key)
+                return meta
+
+    def store(self, key):
+        # returns the AssetStore of an extracted model, None if unknown
+        with self.lock:
+            if key in self.stores:
+                self.stores.move_to_end(key)
+                return self.stores[key][0]
+
+            if self.meta(key) is None:
+                return None
+            self.touch(key)
+            store = hh.asset_server.AssetStore(os.path.join(self.cache_dir, key))
+            size = sum(
+                len(variant)
+                for asset in store.assets.values()
+                for variant in asset.variants.values()
+            )
+            self.stores[key] = (store, size)
+            self.evict_loaded()
+            return store
+
+    def touch(self, key):
+        try:
+            os.utime(os.path.join(self.cache_dir, key, META_FILE))
+        except OSError:
+            pass
+
+    def evict_loaded(self):
+        # drops loaded models beyond the limits, keeping the newest one even
+        # if it is over the size limit on its own
+        total = sum(size for _, size in self.stores.values())
+        while len(self.stores) > 1 and (
+            len(self.stores) > self.max_loaded or total > self.max_loaded_size
+        ):
+            _, (_, size) = self.stores.popitem(last=False)
+            total -= size
+
+    def evict_cached(self, keep=None):
+        # removes extracted models beyond the limits from disk, least recently
+        # used first. loaded models are in use and stay.
+        models = []
+        for key in os.listdir(self.cache_dir):
+            meta = self.meta(key)
+            if meta is None:
+                continue
+            path = os.path.join(self.cache_dir, key)
+            try:
+                used = os.stat(os.path.join(path, META_FILE)).st_mtime
+            except OSError:
+                continue
+            size = meta.get("size")
+            if size is None:
+                size = directory_size(path)
+            models.append((used, key, size))
+        models.sort()
+
+        count = len(models)
+        total = sum(size for _, _, size in models)
+        for _, key, size in models:
+            if count <= self.max_models and total <= self.max_size:
+                break
+            if key == keep or key in self.stores:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            count -= 1
+            total -= size
+
+
+def directory_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+def extract(path, target):
+    # extracts a model zip into target and returns the path of its entry file
+    # relative to target and the size of the extracted files
+    models = []
+    with zipfile.ZipFile(path) as z:
+        # the sizes in the zip can be trusted, zipfile never extracts more
+        # than that and fails on the crc of a file that was cut short
+        infos = z.infolist()
+        if len(infos) > MAX_MODEL_FILES:
+            raise ValueError(f"more than {MAX_MODEL_FILES} files in model zip")
+        size = sum(info.file_size for info in infos)
+        if size > MAX_EXTRACTED_SIZE:
+            raise ValueError(
+                f"model zip extracts to more than {MAX_EXTRACTED_SIZE >> 20} MiB"
+            )
+
+        for info in infos:
+            name = os.path.normpath(info.filename)
+            if os.path.isabs(name) or name.startswith(".."):
+                raise ValueError(f"bad path in model zip: {info.filename}")
+            if info.is_dir():
+                continue
+            z.extract(info, target)
+            models.append(name.replace(os.sep, "/"))
+
+    for suffix in MODEL_SUFFIXES:
+        for name in sorted(models, key=len):
+            if name.endswith(suffix):
+                return name, size
+    raise ValueError("no model file in zip")
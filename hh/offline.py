@@ -0,0 +1,140 @@
+import cv2
+import numpy as np
+
+import hh.capture
+import hh.face_features
+import hh.face_mesh
+import hh.head_pose
+
+# offline tracking splits a video into chunks of frames that are run through
+# face mesh and feature extraction in parallel worker processes. the workers
+# only return the raw features of every frame, matching faces to ids and
+# smoothing are stateful but cheap, so they run afterwards over the chunks in
+# order which keeps both continuous across chunk boundaries.
+
+
+def video_info(path):
+    # returns the frame count, frame rate and frame size of a video, the frame
+    # count is 0 when the container does not know it
+    cap = cv2.VideoCapture(path)
+    assert cap.isOpened(), f"cannot open video: {path}"
+    frames = max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    cap.release()
+    return frames, fps, (width, height)
+
+
+def chunks(frames, chunk_frames):
+    # (start, stop) frame ranges, a single open ended chunk when the frame
+    # count is unknown
+    if frames == 0:
+        return [(0, None)]
+    return [
+        (start, min(start + chunk_frames, frames))
+        for start in range(0, frames, chunk_frames)
+    ]
+
+
+def open_at(path, start):
+    # opens a video at frame start. with many codecs and containers seeking
+    # lands on the nearest keyframe or an approximate timestamp, so the
+    # position is checked and the frames up to start are read and dropped,
+    # from the beginning if the seek went past start
+    cap = cv2.VideoCapture(path)
+    assert cap.isOpened(), f"cannot open video: {path}"
+    if start == 0:
+        return cap
+
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    pos = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    if pos > start or pos < 0:
+        cap.release()
+        cap = cv2.VideoCapture(path)
+        pos = 0
+    while pos < start and cap.grab():
+        pos += 1
+    return cap
+
+
+def read_chunk(cap, start, stop):
+    # yields (index, frame) for the frames of the chunk cap was opened at,
+    # frames in bgr
+    i = start
+    while stop is None or i < stop:
+        g, f = cap.read()
+        if not g:
+            break
+        yield i, f
+        i += 1
+
+
+def track_chunk(
+    path, start, stop, fps=30.0, max_faces=1, head_pose="pnp", flip="vertical"
+):
+    # returns (timestamp, centers, features) for every frame in the chunk,
+    # centers and features are None for frames without a face. features are
+    # the raw head rotation, head translation, mouth ratio, left and right iris
+    # ratios and eye ratios of every face.
+    cap = open_at(path, start)
+    frame_size = (
+        int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+    )
+
+    preprocess = hh.capture.Preprocessor(flip)
+    frame = np.empty((frame_size[1], frame_size[0], 3), dtype=np.uint8)
+
+    # every chunk starts with a fresh detector so that no tracking state leaks
+    # in from whatever chunk the worker ran before
+    face_mesh = hh.face_mesh.FaceMeshDetector(max_faces=max_faces)
+    face_features = hh.face_features.FaceFeaturesCalculator(frame_size)
+    solver = None
+    if head_pose == "pnp":
+        solver = hh.head_pose.HeadPoseSolver(frame_size, max_faces)
+
+    # features are computed for all faces of the chunk in one batch at the end
+    timestamps, centers, lmks = [], [], []
+    for i, f in read_chunk(cap, start, stop):
+        # same preprocessing as the live capture so tracks match its output,
+        # only without scaling the frame down. face mesh marks the frame
+        # read only while it runs.
+        frame.flags.writeable = True
+        _, _, norm_lmks = face_mesh.run(preprocess(f, frame))
+
+        timestamps.append(i / fps)
+        if norm_lmks is None:
+            centers.append(None)
+            lmks.append(None)
+            continue
+
+        centers.append(norm_lmks[:, : hh.face_mesh.NUM_HEAD_LANDMARKS, :2].mean(axis=1))
+        # the detector reuses its buffers
+        lmks.append(norm_lmks.copy())
+
+    cap.release()
+
+    found = [frame_lmks for frame_lmks in lmks if frame_lmks is not None]
+    if not found:
+        return [(timestamp, None, None) for timestamp in timestamps]
+    features = face_features.batch(np.concatenate(found))
+
+    res = []
+    offset = 0
+    for timestamp, frame_centers, frame_lmks in zip(timestamps, centers, lmks):
+        if frame_lmks is None:
+            res.append((timestamp, None, None))
+            continue
+        n = len(frame_lmks)
+        frame_features = tuple(feature[offset : offset + n] for feature in features)
+        if solver is not None:
+            # faces are not matched to ids yet, so the fallback translation is
+            # held per detection instead of per face
+            frame_features = (
+                *solver.solve(frame_lmks, range(n), frame_features[0]),
+                *frame_features[2:],
+            )
+        res.append((timestamp, frame_centers, frame_features))
+        offset += n
+    return res
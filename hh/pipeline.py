@@ -0,0 +1,218 @@
+import multiprocessing
+import os
+import queue
+import threading
+
+from hh.frame_ring import LatestFrame
+from hh.utils import eprint
+
+# stages of the tracking pipeline in the order frames pass through them, the
+# server stands on its own
+STAGES = ("capture", "processing", "output")
+
+PLACEMENTS = ("process", "thread", "inline")
+
+# stages that have no stage in front of them to be inlined into
+NOT_INLINE = ("capture", "server")
+
+LAYOUTS = {
+    # every stage in its own process, best with plenty of cores
+    "processes": {
+        "capture": "process",
+        "processing": "process",
+        "output": "process",
+        "server": "process",
+    },
+    # every stage in a thread of the main process, nothing is pickled
+    "threads": {
+        "capture": "thread",
+        "processing": "thread",
+        "output": "thread",
+        "server": "thread",
+    },
+    # capture, processing and output run one after the other in a single
+    # thread, best with few cores
+    "fused": {
+        "capture": "thread",
+        "processing": "inline",
+        "output": "inline",
+        "server": "thread",
+    },
+}
+
+
+def layout(name, overrides=()):
+    # returns the placement of every stage for a named layout with
+    # "stage=placement" overrides applied
+    placements = dict(LAYOUTS[name])
+    for override in overrides:
+        stage, _, placement = override.partition("=")
+        if stage not in placements:
+            raise ValueError(f"unknown stage: {stage}")
+        if placement not in PLACEMENTS:
+            raise ValueError(f"unknown placement: {placement}")
+        if placement == "inline" and stage in NOT_INLINE:
+            raise ValueError(f"{stage} cannot be placed inline")
+        placements[stage] = placement
+    return placements
+
+
+def parse_cpus(s):
+    # "0-1,3" -> {0, 1, 3}, only cpus this process may run on
+    cpus = set()
+    for part in s.split(","):
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    unavailable = cpus - os.sched_getaffinity(0)
+    if unavailable:
+        raise ValueError(f"cpus not available: {sorted(unavailable)}")
+    return cpus
+
+
+def cpu_settings(placements, cpus=(), nice=(), threads=()):
+    # returns the cpu settings of every stage from "stage=value" options, see
+    # pin. inline stages run in the thread of the stage in front of them and
+    # share its settings.
+    settings = {stage: {} for stage in placements}
+    for key, options, parse in (
+        ("cpus", cpus, parse_cpus),
+        ("nice", nice, int),
+        ("threads", threads, int),
+    ):
+        for option in options:
+            stage, _, value = option.partition("=")
+            if stage not in placements:
+                raise ValueError(f"unknown stage: {stage}")
+            if placements[stage] == "inline":
+                raise ValueError(f"{stage} is inline, set {key} on the stage before")
+            settings[stage][key] = parse(value)
+    return settings
+
+
+def pin(cpus=None, nice=None, threads=None):
+    # pins the calling thread to a set of cpus and sets its nice value, threads
+    # it starts from then on inherit both. threads caps the thread pool of
+    # opencv, which is shared by every thread of the process.
+    tid = threading.get_native_id()
+    if cpus is not None:
+        os.sched_setaffinity(tid, cpus)
+    if nice is not None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, tid, nice)
+        except PermissionError:
+            eprint(f"no permission to set nice {nice}, needs CAP_SYS_NICE")
+    if threads is not None:
+        import cv2
+
+        cv2.setNumThreads(threads)
+
+
+def contexts(placements):
+    # returns the process every stage ends up running in, "main" for the main
+    # process. inline stages run wherever the stage in front of them does.
+    res = {}
+    prev = None
+    for stage in STAGES:
+        placement = placements[stage]
+        if placement == "process":
+            res[stage] = stage
+        elif placement == "thread":
+            res[stage] = "main"
+        else:
+            res[stage] = res[prev]
+        prev = stage
+    return res
+
+
+def channel(placements, producer, consumer, size, latest=False):
+    # returns the cheapest queue that works between two stages
+    if placements[consumer] == "inline":
+        return Inline()
+    if latest:
+        return LatestFrame()
+    ctx = contexts(placements)
+    if ctx[producer] == ctx[consumer] == "main":
+        return queue.Queue(size)
+    return multiprocessing.Queue(size)
+
+
+def handoff(placements, stage):
+    # returns a queue for handing a single item from the main process to a
+    # stage that is already running
+    if contexts(placements)[stage] == "main":
+        return queue.Queue(1)
+    return multiprocessing.Queue(1)
+
+
+# stands in for the queue in front of an inline stage. every item is handed
+# straight to the stage in the thread of the stage that puts it, the inline
+# stage is set up in that thread on the first item.
+class Inline:
+    def __init__(self):
+        self.stage = None
+        self.ready = False
+
+    def full(self):
+        return False
+
+    def put(self, item, block=True, timeout=None):
+        if not self.ready:
+            self.stage.setup()
+            self.ready = True
+        self.stage.handle(item)
+
+    def put_nowait(self, item):
+        self.put(item)
+
+
+# a pipeline stage that is started in its own process, in a thread or not at
+# all when it is inline and driven by the stage in front of it. stages with an
+# input read it from self.iq, set themselves up in setup and handle one item
+# at a time in handle.
+class Stage:
+    def __init__(self):
+        self.iq = None
+        self.worker = None
+        self.killed = False
+
+    def start(self, placement="process", cpu=None):
+        # cpu holds the keyword arguments of pin for the stage
+        if isinstance(self.iq, Inline):
+            self.iq.stage = self
+        if placement == "process":
+            self.worker = multiprocessing.Process(target=self.bootstrap, args=(cpu,))
+        elif placement == "thread":
+            self.worker = threading.Thread(
+                target=self.bootstrap, args=(cpu,), daemon=True
+            )
+        else:
+            return
+        self.worker.start()
+
+    def bootstrap(self, cpu):
+        if cpu:
+            pin(**cpu)
+        self.run()
+
+    def is_alive(self):
+        return self.worker is not None and self.worker.is_alive()
+
+    def terminate(self):
+        if isinstance(self.worker, multiprocessing.Process):
+            self.worker.terminate()
+        else:
+            self.stop()
+
+    def stop(self):
+        self.killed = True
+
+    def setup(self):
+        pass
+
+    def handle(self, item):
+        raise NotImplementedError
+
+    def run(self):
+        self.setup()
+        while not self.killed:
+            self.handle(self.iq.get())
@@ -0,0 +1,279 @@
+from multiprocessing import Condition, Value
+from multiprocessing.sharedctypes import RawArray
+import threading
+
+import cv2
+import numpy as np
+
+from hh.face_mesh import NUM_HEAD_LANDMARKS, face_contours
+from hh.frame_ring import FrameRing
+
+# face rows in the pose ring: head rotation, left iris ratio, right iris ratio
+POSE_SIZE = 7
+
+
+# downscaled frames and tracking results handed from processing to the preview
+# consumers, which do all of the drawing and encoding in their own process.
+# processing only publishes while a consumer has a client connected and at most
+# fps times a second, so an unwatched preview costs one shared counter read per
+# frame.
+#
+# slots are guarded seqlock style instead of being held, so any number of
+# consumers can read them: a slot's sequence number is cleared while it is
+# written and a copy is only used if the number did not change while copying.
+class Preview:
+    def __init__(self, frame_size, max_faces=1, fps=15.0, width=320, slots=4):
+        self.fps = fps
+        scale = min(width / frame_size[0], 1.0)
+        self.size = (round(frame_size[0] * scale), round(frame_size[1] * scale))
+        self.max_faces = max_faces
+        self.slots = slots
+
+        self.frames = FrameRing((self.size[1], self.size[0], 3), slots=slots)
+        self.lmks = FrameRing(
+            (max_faces, NUM_HEAD_LANDMARKS, 2), dtype=np.float32, slots=slots
+        )
+        self.poses = FrameRing((max_faces, POSE_SIZE), dtype=np.float64, slots=slots)
+        self.slot_seqs = RawArray("Q", slots)
+        self.face_counts = RawArray("i", slots)
+
+        # consumers with at least one client count themselves in here
+        self.clients = Value("i", 0)
+
+        self.cond = Condition()
+        self.seq = Value("Q", 0, lock=False)
+        self.slot = Value("i", -1, lock=False)
+
+        # only used on the producer side
+        self.last_time = 0.0
+
+    def connect(self):
+        with self.clients.get_lock():
+            self.clients.value += 1
+
+    def disconnect(self):
+        with self.clients.get_lock():
+            self.clients.value -= 1
+
+    def wanted(self, now):
+        return self.clients.value > 0 and now - self.last_time >= 1.0 / self.fps
+
+    def publish(self, now, frame, lmks, head_rotation, left_iris, right_iris):
+        # lmks are the pixel landmarks of every face, the rest one row per face.
+        # the preview is sized before the camera is open, so frames of another
+        # size are stretched to it and their landmarks scaled to match.
+        self.last_time = now
+        scale = (self.size[0] / frame.shape[1], self.size[1] / frame.shape[0])
+
+        slot = (self.slot.value + 1) % self.slots
+        self.slot_seqs[slot] = 0
+
+        cv2.resize(
+            frame, self.size, dst=self.frames[slot], interpolation=cv2.INTER_AREA
+        )
+        n = min(len(lmks), self.max_faces)
+        self.face_counts[slot] = n
+        if n > 0:
+            np.multiply(lmks[:n], scale, out=self.lmks[slot][:n])
+            poses = self.poses[slot]
+            poses[:n, 0:3] = head_rotation[:n]
+            poses[:n, 3:5] = left_iris[:n]
+            poses[:n, 5:7] = right_iris[:n]
+
+        with self.cond:
+            self.seq.value += 1
+            self.slot_seqs[slot] = self.seq.value
+            self.slot.value = slot
+            self.cond.notify_all()
+
+    def get(self, last_seq, timeout=None):
+        # returns (seq, frame, lmks, poses) copies of the newest preview frame
+        # published after last_seq, None on timeout or a torn read. the frame
+        # is turned from the pipeline's rgb into bgr for drawing and encoding
+        # while it is copied.
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.seq.value != last_seq, timeout):
+                return None
+            seq, slot = self.seq.value, self.slot.value
+
+        n = self.face_counts[slot]
+        frame = cv2.cvtColor(self.frames[slot], cv2.COLOR_RGB2BGR)
+        lmks = self.lmks[slot][:n].copy()
+        poses = self.poses[slot][:n].copy()
+        if self.slot_seqs[slot] != seq:
+            return None
+        return seq, frame, lmks, poses
+
+    def close(self):
+        self.frames.close()
+        self.lmks.close()
+        self.poses.close()
+
+
+def draw(frame, lmks, poses):
+    for face_lmks, pose in zip(lmks, poses):
+        # draw face contours
+        points = face_lmks.astype(np.int32)
+        for i, j in face_contours():
+            cv2.line(frame, tuple(points[i]), tuple(points[j]), (255, 255, 255), 1)
+
+        # draw head pose axis
+        head_sin_pitch, head_sin_yaw, head_sin_roll = np.sin(np.deg2rad(pose[0:3]))
+        head_cos_pitch, head_cos_yaw, head_cos_roll = np.cos(np.deg2rad(pose[0:3]))
+        head_center = np.mean(face_lmks, axis=0)
+        head_axis = np.array(
+            [
+                (
+                    head_cos_yaw * head_cos_roll,
+                    head_cos_pitch * head_sin_roll
+                    + head_cos_roll * head_sin_pitch * head_sin_yaw,
+                ),
+                (
+                    -head_cos_yaw * head_sin_roll,
+                    head_cos_pitch * head_cos_roll
+                    - head_sin_pitch * head_sin_yaw * head_sin_roll,
+                ),
+                (head_sin_yaw, -head_cos_yaw * head_sin_pitch),
+            ]
+        )
+        head_axis *= frame.shape[1] / 4
+        head_axis += head_center
+        for axis, color in zip(head_axis, ((0, 0, 255), (0, 255, 0), (255, 0, 0))):
+            cv2.line(
+                frame,
+                (int(head_center[0]), int(head_center[1])),
+                (int(axis[0]), int(axis[1])),
+                color,
+                3,
+            )
+
+        # draw iris circles
+        for iris_ratio, color in (
+            (pose[3:5], (0, 0, 255)),
+            (pose[5:7], (0, 255, 255)),
+        ):
+            cv2.circle(
+                frame,
+                (
+                    int(iris_ratio[0] * (frame.shape[1] / 3)) + int(frame.shape[1] / 2),
+                    int(iris_ratio[1] * (frame.shape[0] / 3)) + int(frame.shape[0] / 2),
+                ),
+                4,
+                color,
+                2,
+            )
+
+    return frame
+
+
+PREVIEW_FORMATS = {
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+
+def encode(frame, format="jpeg", width=None, quality=80):
+    # returns the frame downscaled to width and encoded, None on failure
+    if width is not None and width < frame.shape[1]:
+        height = round(frame.shape[0] * width / frame.shape[1])
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    ext, param = PREVIEW_FORMATS[format]
+    b, data = cv2.imencode(ext, frame, [param, quality])
+    return data.tobytes() if b else None
+
+
+# preview stream requested by a websocket client with a control message like
+# {"control": "preview", "format": "webp", "width": 480, "fps": 10}. the client
+# sends {"control": "ack"} after every frame it has drawn and only gets the
+# next frame after that, so a client that decodes slowly skips frames instead
+# of queueing them up.
+class PreviewRequest:
+    # unacked frames are given up on after this many seconds
+    ACK_TIMEOUT = 2.0
+
+    def __init__(self, control):
+        self.format = control.get("format", "jpeg")
+        if self.format not in PREVIEW_FORMATS:
+            self.format = "jpeg"
+        self.width = max(int(control.get("width", 320)), 16)
+        self.fps = max(float(control.get("fps", 15.0)), 0.1)
+        self.quality = min(max(int(control.get("quality", 80)), 1), 100)
+
+        self.acked = True
+        self.last_time = 0.0
+
+    def due(self, now):
+        if not self.acked and now - self.last_time < self.ACK_TIMEOUT:
+            return False
+        return now - self.last_time >= 1.0 / self.fps
+
+    def sent(self, now):
+        self.acked = False
+        self.last_time = now
+
+    def key(self):
+        return self.format, self.width, self.quality
+
+
+# draws and encodes preview frames in a background thread while anyone is
+# watching. every frame is encoded once and shared by all clients.
+class PreviewStream:
+    def __init__(self, preview, quality=80):
+        self.preview = preview
+        self.quality = quality
+
+        self.cond = threading.Condition()
+        self.jpeg = None
+        self.seq = 0
+        self.watchers = 0
+        self.thread = None
+
+    def frames(self):
+        # yields jpeg frames for a single client until it is closed
+        self.attach()
+        try:
+            seq = self.seq
+            while True:
+                with self.cond:
+                    if not self.cond.wait_for(lambda: self.seq != seq, 1.0):
+                        continue
+                    seq, jpeg = self.seq, self.jpeg
+                yield jpeg
+        finally:
+            self.detach()
+
+    def attach(self):
+        with self.cond:
+            self.watchers += 1
+            if self.watchers == 1:
+                self.preview.connect()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def detach(self):
+        with self.cond:
+            self.watchers -= 1
+            if self.watchers == 0:
+                self.preview.disconnect()
+
+    def run(self):
+        last_seq = 0
+        while True:
+            with self.cond:
+                if self.watchers == 0:
+                    self.thread = None
+                    return
+
+            res = self.preview.get(last_seq, timeout=1.0)
+            if res is None:
+                continue
+            last_seq, frame, lmks, poses = res
+
+            jpeg = encode(draw(frame, lmks, poses), quality=self.quality)
+            if jpeg is None:
+                continue
+            with self.cond:
+                self.jpeg = jpeg
+                self.seq += 1
+                self.cond.notify_all()
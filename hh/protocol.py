@@ -0,0 +1,73 @@
+import json
+import struct
+
+import numpy as np
+
+# tracking frames are sent either as json or as a binary frame made of a small
+# header followed by one block per tracked face, each block holding the face id
+# and the channels as packed little endian float32 values.
+# index/index.js has the matching decoder, keep the two in sync and bump
+# WIRE_VERSION whenever the layout changes.
+WIRE_MAGIC = b"hh"
+WIRE_VERSION = 2
+
+# magic, version, channel count, face count, sequence number, capture timestamp
+WIRE_HEADER = struct.Struct("<2sBBB3xId")
+
+# (group, key) of every channel in wire order. head rotation is in degrees and
+# head translation is the position of the head relative to the camera in face
+# model units, which are about a centimeter.
+WIRE_CHANNELS = (
+    ("head_rotation", "x"),
+    ("head_rotation", "y"),
+    ("head_rotation", "z"),
+    ("head_translation", "x"),
+    ("head_translation", "y"),
+    ("head_translation", "z"),
+    ("iris", "x"),
+    ("iris", "y"),
+    ("eye", "left"),
+    ("eye", "right"),
+    ("mouth", "x"),
+    ("mouth", "y"),
+)
+NUM_WIRE_CHANNELS = len(WIRE_CHANNELS)
+
+WIRE_FORMATS = ("json", "binary")
+
+
+def to_dict(values):
+    res = {}
+    for (group, key), value in zip(WIRE_CHANNELS, values.tolist()):
+        res.setdefault(group, {})[key] = value
+    return res
+
+
+# values are the channels of the primary face, faces holds one row per tracked
+# face made of its id followed by its channels
+def encode_json(values, faces):
+    res = to_dict(values)
+    res["faces"] = [{"id": int(face[0]), **to_dict(face[1:])} for face in faces]
+    return json.dumps(res)
+
+
+def encode_binary(faces, seq, timestamp):
+    header = WIRE_HEADER.pack(
+        WIRE_MAGIC,
+        WIRE_VERSION,
+        NUM_WIRE_CHANNELS,
+        len(faces),
+        seq & 0xFFFFFFFF,
+        timestamp,
+    )
+    return header + faces.astype("<f4", copy=False).tobytes()
+
+
+def decode_binary(data):
+    magic, version, count, num_faces, seq, timestamp = WIRE_HEADER.unpack_from(data)
+    assert magic == WIRE_MAGIC, "not a tracking frame"
+    assert version == WIRE_VERSION, f"unsupported wire version: {version}"
+    faces = np.frombuffer(
+        data, dtype="<f4", count=num_faces * (1 + count), offset=WIRE_HEADER.size
+    )
+    return seq, timestamp, faces.reshape((num_faces, 1 + count))
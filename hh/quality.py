@@ -0,0 +1,125 @@
+from collections import deque
+import time
+
+from hh.utils import eprint
+
+# operating points from full quality down. scale is the factor frames are
+# scaled by before inference, iris False skips iris refinement while the eyes
+# are closed and stride runs inference on every stride-th frame only.
+LADDER = (
+    {"scale": 1.0, "iris": True, "stride": 1},
+    {"scale": 0.75, "iris": True, "stride": 1},
+    {"scale": 0.5, "iris": True, "stride": 1},
+    {"scale": 0.5, "iris": False, "stride": 1},
+    {"scale": 0.5, "iris": False, "stride": 2},
+    {"scale": 0.5, "iris": False, "stride": 3},
+)
+
+# eye openness below which an eye counts as closed, and the frames both eyes of
+# every face must stay closed for before iris refinement is skipped. blinks are
+# too short to be worth the detection switching face meshes costs.
+EYE_CLOSED = 0.1
+CLOSED_FRAMES = 5
+
+
+# steps the ladder to keep the mean processing time of recent frames under a
+# deadline. quality drops a step as soon as a full window of frames misses the
+# deadline on average and comes back a step once frames took less than headroom
+# of the deadline for settle frames in a row. a step up that is undone right
+# away doubles the frames the next step up waits for, so a level that just
+# barely does not fit is not retried on every settle.
+class QualityController:
+    def __init__(
+        self,
+        deadline,
+        ladder=LADDER,
+        window=15,
+        headroom=0.6,
+        settle=90,
+        max_settle=1440,
+    ):
+        self.deadline = deadline
+        self.ladder = ladder
+        self.headroom = headroom
+        self.settle = settle
+        self.max_settle = max_settle
+
+        self.level = 0
+        self.closed = 0
+        self.times = deque(maxlen=window)
+        self.total = 0.0
+        self.calm = 0
+        self.wait = settle
+
+        # frames since the last change and whether it was a step up
+        self.held = 0
+        self.raised = False
+
+        # (time, level, mean frame time) of the last changes
+        self.changes = 0
+        self.history = deque(maxlen=32)
+
+    @property
+    def settings(self):
+        return self.ladder[self.level]
+
+    def refine(self, eye_ratios):
+        # returns whether the next frame needs iris refinement given the eye
+        # openness of every face in this one, None when no face was found
+        if (
+            eye_ratios is not None
+            and len(eye_ratios) > 0
+            and (eye_ratios < EYE_CLOSED).all()
+        ):
+            self.closed += 1
+        else:
+            self.closed = 0
+        return self.settings["iris"] or self.closed < CLOSED_FRAMES
+
+    def update(self, seconds):
+        # records the processing time of a frame, returns True if the level
+        # changed
+        if len(self.times) == self.times.maxlen:
+            self.total -= self.times[0]
+        self.times.append(seconds)
+        self.total += seconds
+        self.held += 1
+        if len(self.times) < self.times.maxlen:
+            return False
+
+        mean = self.total / len(self.times)
+        if mean > self.deadline:
+            self.calm = 0
+            if self.level + 1 < len(self.ladder):
+                if self.raised and self.held <= 2 * self.times.maxlen:
+                    self.wait = min(self.wait * 2, self.max_settle)
+                else:
+                    self.wait = self.settle
+                self.change(self.level + 1, mean)
+                return True
+        elif mean < self.deadline * self.headroom:
+            self.calm += 1
+            if self.calm >= self.wait and self.level > 0:
+                self.change(self.level - 1, mean)
+                return True
+        else:
+            self.calm = 0
+        return False
+
+    def change(self, level, mean):
+        self.raised = level < self.level
+        self.level = level
+        self.times.clear()
+        self.total = 0.0
+        self.calm = 0
+        self.held = 0
+        self.changes += 1
+        self.history.append((time.time(), level, mean))
+
+        settings = self.settings
+        eprint(
+            f"quality level {level}: frames took {mean * 1000:.1f}ms of "
+            f"{self.deadline * 1000:.1f}ms, scale {settings['scale']:g}, iris "
+            f"{'always' if settings['iris'] else 'while eyes open'}, inference "
+            f"every {settings['stride']} frames"
+        )
@@ -0,0 +1,178 @@
+import os
+import struct
+
+import cv2
+import numpy as np
+
+# a recording is a directory holding two append-only files:
+#
+#   frames.bin      header (magic, version, width, height) followed by one
+#                   record per captured frame: capture timestamp, jpeg size and
+#                   the jpeg bytes. frames are rgb in the pipeline but stored
+#                   as ordinary jpegs.
+#   landmarks.bin   header (magic, version) followed by one record per processed
+#                   frame: capture timestamp, face count, landmark count per face
+#                   and the normalized landmarks of every face as float32
+#                   (x, y, z) triples
+#
+# frames and landmarks are matched up by their capture timestamp. the files are
+# unbuffered since the pipeline processes are terminated rather than stopped,
+# a truncated last record is ignored when reading.
+#
+# offline processing writes a single track file instead: header (magic,
+# version, channel count) followed by one record per video frame: timestamp,
+# face count and one row per face made of the face id and the channels in
+# hh.protocol.WIRE_CHANNELS order, all float32.
+RECORDING_VERSION = 2
+
+FRAMES_FILE = "frames.bin"
+FRAMES_HEADER = struct.Struct("<4sHHH")
+FRAMES_MAGIC = b"HHRF"
+FRAME_RECORD = struct.Struct("<dI")
+
+LANDMARKS_FILE = "landmarks.bin"
+LANDMARKS_HEADER = struct.Struct("<4sH")
+LANDMARKS_MAGIC = b"HHRL"
+LANDMARK_RECORD = struct.Struct("<dBH")
+
+TRACK_HEADER = struct.Struct("<4sHH")
+TRACK_MAGIC = b"HHRT"
+TRACK_RECORD = struct.Struct("<dB")
+
+
+class FrameWriter:
+    def __init__(self, path, frame_size, quality=95):
+        os.makedirs(path, exist_ok=True)
+
+        self.f = open(os.path.join(path, FRAMES_FILE), "wb", buffering=0)
+        self.f.write(
+            FRAMES_HEADER.pack(
+                FRAMES_MAGIC, RECORDING_VERSION, frame_size[0], frame_size[1]
+            )
+        )
+
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        self.bgr = None
+
+    def write(self, frame, timestamp):
+        self.bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR, dst=self.bgr)
+        b, jpeg = cv2.imencode(".jpg", self.bgr, self.params)
+        if not b:
+            return
+
+        self.f.write(FRAME_RECORD.pack(timestamp, len(jpeg)) + jpeg.tobytes())
+
+    def close(self):
+        self.f.close()
+
+
+class LandmarkWriter:
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+
+        self.f = open(os.path.join(path, LANDMARKS_FILE), "wb", buffering=0)
+        self.f.write(LANDMARKS_HEADER.pack(LANDMARKS_MAGIC, RECORDING_VERSION))
+
+    def write(self, norm_lmks, timestamp):
+        if norm_lmks is None:
+            self.f.write(LANDMARK_RECORD.pack(timestamp, 0, 0))
+            return
+
+        faces, n, _ = norm_lmks.shape
+        self.f.write(
+            LANDMARK_RECORD.pack(timestamp, faces, n)
+            + norm_lmks.astype("<f4", copy=False).tobytes()
+        )
+
+    def close(self):
+        self.f.close()
+
+
+class TrackWriter:
+    def __init__(self, path, channels):
+        self.channels = channels
+
+        self.f = open(path, "wb")
+        self.f.write(TRACK_HEADER.pack(TRACK_MAGIC, RECORDING_VERSION, channels))
+
+    def write(self, faces, timestamp):
+        self.f.write(
+            TRACK_RECORD.pack(timestamp, len(faces))
+            + faces.astype("<f4", copy=False).tobytes()
+        )
+
+    def close(self):
+        self.f.close()
+
+
+def read_frame_size(path):
+    with open(os.path.join(path, FRAMES_FILE), "rb") as f:
+        magic, version, width, height = FRAMES_HEADER.unpack(f.read(FRAMES_HEADER.size))
+    assert magic == FRAMES_MAGIC, f"not a recording: {path}"
+    assert version == RECORDING_VERSION, f"unsupported recording version: {version}"
+    return width, height
+
+
+def read_frames(path):
+    # yields (timestamp, frame) pairs, frames in rgb
+    with open(os.path.join(path, FRAMES_FILE), "rb") as f:
+        magic, version, _, _ = FRAMES_HEADER.unpack(f.read(FRAMES_HEADER.size))
+        assert magic == FRAMES_MAGIC, f"not a recording: {path}"
+        assert version == RECORDING_VERSION, f"unsupported recording version: {version}"
+
+        while True:
+            record = f.read(FRAME_RECORD.size)
+            if len(record) < FRAME_RECORD.size:
+                return
+            timestamp, size = FRAME_RECORD.unpack(record)
+            data = f.read(size)
+            if len(data) < size:
+                return
+            jpeg = np.frombuffer(data, dtype=np.uint8)
+            frame = cv2.imdecode(jpeg, cv2.IMREAD_COLOR)
+            yield timestamp, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
+
+
+def read_landmarks(path):
+    # returns a dict of capture timestamp to landmarks of shape
+    # (faces, landmarks, 3), None when no face was found in that frame
+    res = {}
+    with open(os.path.join(path, LANDMARKS_FILE), "rb") as f:
+        magic, version = LANDMARKS_HEADER.unpack(f.read(LANDMARKS_HEADER.size))
+        assert magic == LANDMARKS_MAGIC, f"not a recording: {path}"
+        assert version == RECORDING_VERSION, f"unsupported recording version: {version}"
+
+        while True:
+            record = f.read(LANDMARK_RECORD.size)
+            if len(record) < LANDMARK_RECORD.size:
+                return res
+            timestamp, faces, n = LANDMARK_RECORD.unpack(record)
+            if faces == 0:
+                res[timestamp] = None
+            else:
+                size = faces * n * 3 * 4
+                data = f.read(size)
+                if len(data) < size:
+                    return res
+                res[timestamp] = np.frombuffer(data, dtype="<f4").reshape(faces, n, 3)
+
+
+def read_track(path):
+    # yields (timestamp, faces) pairs, faces being of shape (faces, 1 + channels)
+    with open(path, "rb") as f:
+        magic, version, channels = TRACK_HEADER.unpack(f.read(TRACK_HEADER.size))
+        assert magic == TRACK_MAGIC, f"not a track: {path}"
+        assert version == RECORDING_VERSION, f"unsupported track version: {version}"
+
+        while True:
+            record = f.read(TRACK_RECORD.size)
+            if len(record) < TRACK_RECORD.size:
+                return
+            timestamp, faces = TRACK_RECORD.unpack(record)
+            size = faces * (1 + channels) * 4
+            data = f.read(size)
+            if len(data) < size:
+                return
+            yield timestamp, np.frombuffer(data, dtype="<f4").reshape(
+                faces, 1 + channels
+            )
@@ -0,0 +1,72 @@
+import numpy as np
+
+from hh.smoother import PredictorCV
+
+
+# resamples tracking frames arriving at inference rate to a fixed output rate.
+# every face gets a constant velocity predictor that is updated with each
+# inference result and extrapolated to the output ticks in between. the
+# prediction runs from the time a result arrived, so output latency stays the
+# same as without the scheduler. it is held after one inference interval, or
+# max_horizon seconds at most, so a late or stalled inference neither
+# overshoots nor sends the avatar drifting off.
+class OutputScheduler:
+    def __init__(self, channels, max_horizon=0.1, smoothing=0.1):
+        self.channels = channels
+        self.max_horizon = max_horizon
+
+        # the inference interval is an exponential average of the time between
+        # results with this weight for the newest one
+        self.smoothing = smoothing
+        self.interval = 0.0
+
+        # face id -> predictor
+        self.predictors = {}
+
+        # inference results as (values, faces) like ThreadedProcessing sends
+        self.values = None
+        self.faces = None
+        self.timestamp = 0.0
+        self.arrival = 0.0
+
+    def update(self, values, faces, timestamp, arrival):
+        dt = timestamp - self.timestamp
+        if self.faces is not None and dt > 0:
+            if self.interval == 0.0:
+                self.interval = dt
+            else:
+                self.interval += self.smoothing * (dt - self.interval)
+
+        predictors = {}
+        for face in faces:
+            face_id = int(face[0])
+            predictor = self.predictors.get(face_id)
+            if predictor is None:
+                predictor = PredictorCV(self.channels)
+            predictor.update(face[1:], dt)
+            predictors[face_id] = predictor
+        self.predictors = predictors
+
+        self.values = values
+        self.faces = faces
+        self.timestamp = timestamp
+        self.arrival = arrival
+
+    def sample(self, now):
+        # returns (values, faces, timestamp) extrapolated to now, None before
+        # the first update
+        if self.faces is None:
+            return None
+
+        limit = self.max_horizon
+        if self.interval > 0:
+            limit = min(limit, self.interval)
+        horizon = min(max(now - self.arrival, 0.0), limit)
+        faces = np.empty_like(self.faces)
+        faces[:, 0] = self.faces[:, 0]
+        for i, face_id in enumerate(self.predictors):
+            faces[i, 1:] = self.predictors[face_id].predict(horizon)
+
+        # the primary face is the first one, values are held without faces
+        values = faces[0, 1:] if len(faces) > 0 else self.values
+        return values, faces, self.timestamp + horizon
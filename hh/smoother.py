@@ -1,17 +1,16 @@
 import math
 
-import cv2
 import numpy as np
 
 
 class SmootherKF:
     def __init__(self):
+        import cv2
+
         self.filter = cv2.KalmanFilter(2, 1, 0)
-        self.filter.transitionMatrix = np.array([[1, 1],
-                                                 [0, 1]], dtype=np.float32)
+        self.filter.transitionMatrix = np.array([[1, 1], [0, 1]], dtype=np.float32)
         self.filter.measurementMatrix = np.array([[1, 1]], dtype=np.float32)
-        self.filter.processNoiseCov = np.array([[1, 0],
-                                                [0, 1]], dtype=np.float32) * 0.1
+        self.filter.processNoiseCov = np.array([[1, 0], [0, 1]], dtype=np.float32) * 0.1
         self.filter.measurementNoiseCov = np.array([[1]], dtype=np.float32) * 0.1
 
         self.measurement = np.zeros((1, 1), dtype=np.float32)
@@ -101,3 +100,165 @@ def smoothing_factor(dt, cutoff):
 def exponential_smoothing(a, x, x_prev):
     return a * x + (1 - a) * x_prev
 
+
+# holds the state of `n` independent scalar smoothers in contiguous arrays so
+# that all channels are updated with a single vectorized call per frame.
+# filter parameters may be scalars or per-channel sequences.
+class SmootherBank:
+    KINDS = ("one_euro", "dema", "tema", "kf")
+
+    def __init__(self, n, kind="one_euro", **params):
+        assert kind in self.KINDS, f"unknown smoother kind: {kind}"
+
+        self.n = n
+        self.kind = kind
+
+        if kind == "one_euro":
+            self.min_cutoff = _channel_param(params.get("min_cutoff", 1.0), n)
+            self.beta = _channel_param(params.get("beta", 0.0), n)
+            self.d_cutoff = _channel_param(params.get("d_cutoff", 1.0), n)
+
+            self.x_prev = np.zeros(n)
+            self.dx_prev = np.zeros(n)
+        elif kind in ("dema", "tema"):
+            self.a = _channel_param(params.get("a", 0.06), n)
+
+            # one row per ema stage
+            self.emas = np.zeros((2 if kind == "dema" else 3, n))
+        else:
+            # same model as SmootherKF, position + velocity per channel
+            self.q = _channel_param(params.get("q", 0.1), n)
+            self.r = _channel_param(params.get("r", 0.1), n)
+
+            self.x = np.zeros((n, 2))
+            self.p = np.zeros((n, 2, 2))
+
+        self.state = np.zeros(n)
+
+    def reset(self, channels=slice(None)):
+        if self.kind == "one_euro":
+            self.x_prev[channels] = 0.0
+            self.dx_prev[channels] = 0.0
+        elif self.kind in ("dema", "tema"):
+            self.emas[:, channels] = 0.0
+        else:
+            self.x[channels] = 0.0
+            self.p[channels] = 0.0
+
+        self.state[channels] = 0.0
+
+    def update(self, measurements, dt):
+        z = np.asarray(measurements, dtype=np.float64).reshape(self.n)
+
+        if self.kind == "one_euro":
+            self._update_one_euro(z, dt)
+        elif self.kind in ("dema", "tema"):
+            self._update_ema(z)
+        else:
+            self._update_kf(z)
+
+        return self.state
+
+    def _update_one_euro(self, z, dt):
+        a_d = smoothing_factor(dt, self.d_cutoff)
+        dx = (z - self.x_prev) / dt
+        dx_hat = exponential_smoothing(a_d, dx, self.dx_prev)
+
+        cutoff = self.min_cutoff + self.beta * np.abs(dx_hat)
+        a = smoothing_factor(dt, cutoff)
+        x_hat = exponential_smoothing(a, z, self.x_prev)
+
+        self.x_prev[:] = x_hat
+        self.dx_prev[:] = dx_hat
+
+        self.state[:] = x_hat
+
+    def _update_ema(self, z):
+        prev = z
+        for s in self.emas:
+            s[:] = ema(self.a, prev, s)
+            prev = s
+
+        if self.kind == "dema":
+            self.state[:] = (2.0 * self.emas[0]) - self.emas[1]
+        else:
+            self.state[:] = (3.0 * self.emas[0]) - (3.0 * self.emas[1]) + self.emas[2]
+
+    def _update_kf(self, z):
+        # predict with F = [[1, 1], [0, 1]], Q = q * I
+        x0 = self.x[:, 0] + self.x[:, 1]
+        x1 = self.x[:, 1]
+
+        p00, p01 = self.p[:, 0, 0], self.p[:, 0, 1]
+        p10, p11 = self.p[:, 1, 0], self.p[:, 1, 1]
+        pp00 = p00 + p01 + p10 + p11 + self.q
+        pp01 = p01 + p11
+        pp10 = p10 + p11
+        pp11 = p11 + self.q
+
+        # correct with H = [1, 1], R = r
+        ph0 = pp00 + pp01
+        ph1 = pp10 + pp11
+        s = ph0 + ph1 + self.r
+        k0 = ph0 / s
+        k1 = ph1 / s
+
+        y = z - (x0 + x1)
+        self.x[:, 0] = x0 + k0 * y
+        self.x[:, 1] = x1 + k1 * y
+
+        hp0 = pp00 + pp10
+        hp1 = pp01 + pp11
+        self.p[:, 0, 0] = pp00 - k0 * hp0
+        self.p[:, 0, 1] = pp01 - k0 * hp1
+        self.p[:, 1, 0] = pp10 - k1 * hp0
+        self.p[:, 1, 1] = pp11 - k1 * hp1
+
+        self.state[:] = self.x[:, 0]
+
+
+# constant velocity predictor over `n` channels, driven by the real time step
+# so positions can be extrapolated to any time after the last update. the
+# measurements are already smoothed, so positions are taken as they are and
+# only the velocity is estimated. it is limited like a minmod slope limiter: the
+# smaller of the last two velocities if both point the same way, zero if not.
+# a sudden jump has no velocity behind it and is not extrapolated past where it
+# landed, while steady motion is extrapolated at full speed.
+class PredictorCV:
+    def __init__(self, n):
+        self.n = n
+
+        self.x = np.zeros(n)
+        self.v = np.zeros(n)
+        self.prev_v = np.zeros(n)
+        self.initialized = False
+
+    def reset(self, measurements):
+        self.x[:] = measurements
+        self.v[:] = 0.0
+        self.prev_v[:] = 0.0
+        self.initialized = True
+
+    def update(self, measurements, dt):
+        z = np.asarray(measurements, dtype=np.float64).reshape(self.n)
+        if not self.initialized:
+            self.reset(z)
+            return self.x
+
+        if dt > 0:
+            v = (z - self.x) / dt
+            same = np.sign(v) == np.sign(self.prev_v)
+            self.v[:] = np.where(
+                same, np.sign(v) * np.minimum(np.abs(v), np.abs(self.prev_v)), 0.0
+            )
+            self.prev_v[:] = v
+        self.x[:] = z
+        return self.x
+
+    def predict(self, dt):
+        # positions dt seconds after the last update, the state is not changed
+        return self.x + dt * self.v
+
+
+def _channel_param(value, n):
+    return np.array(np.broadcast_to(np.asarray(value, dtype=np.float64), (n,)))
@@ -0,0 +1,252 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+import json
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+# text messages starting with this are json control messages for the server
+# instead of messages to relay, e.g. {"control": "preview", ...}
+CONTROL_PREFIX = '{"control"'
+
+# topics clients subscribe to with {"control": "subscribe", "topics": [...]} and
+# leave with "unsubscribe". tracking carries the tracking frames, preview the
+# preview frames a client asked for and control the messages clients send each
+# other.
+TOPICS = ("tracking", "preview", "control")
+
+# topics every client is subscribed to on connect, unless it picks its own with
+# a topics parameter in the url, e.g. ws://127.0.0.1:6789/?topics=preview
+DEFAULT_TOPICS = ("tracking", "control")
+
+# topics whose messages are all delivered in order instead of only the newest
+FIFO_TOPICS = ("control",)
+
+# messages of fifo topics waiting per client, newer ones are dropped beyond that
+CLIENT_QUEUE_SIZE = 64
+
+# messages of fifo topics waiting to be fanned out, newer ones are dropped
+# beyond that
+FANOUT_QUEUE_SIZE = 256
+
+
+# a connected websocket client. every stream (tracking frames, preview frames,
+# ...) gets a single pending slot per client and newer messages replace older
+# ones that were not sent yet, so a slow client skips frames instead of holding
+# up everyone else. fifo streams like relayed messages are queued in order
+# instead, up to CLIENT_QUEUE_SIZE messages.
+class WSClient:
+    def __init__(self, ws, metrics=None):
+        self.ws = ws
+        self.metrics = metrics
+
+        self.pending = {}
+        self.queues = {}
+        self.ready = asyncio.Event()
+
+        self.sent = 0
+        self.dropped = 0
+        self.send_time = 0.0
+        self.max_send_time = 0.0
+
+    def push(self, stream, message, fifo=False):
+        if fifo:
+            q = self.queues.setdefault(stream, deque())
+            if len(q) >= CLIENT_QUEUE_SIZE:
+                self.drop()
+                return
+            q.append(message)
+        else:
+            if stream in self.pending:
+                self.drop()
+            self.pending[stream] = message
+        self.ready.set()
+
+    def drop(self):
+        self.dropped += 1
+        if self.metrics is not None:
+            self.metrics.count("client_dropped")
+
+    def next(self):
+        # returns the next message to send, latest-wins streams first since
+        # they are the latency sensitive ones, None once everything is sent
+        if self.pending:
+            return self.pending.pop(next(iter(self.pending)))
+        for q in self.queues.values():
+            if q:
+                return q.popleft()
+        return None
+
+    async def pump(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+
+            while True:
+                message = self.next()
+                if message is None:
+                    break
+
+                start = time.perf_counter()
+                try:
+                    await self.ws.send(message)
+                except ConnectionClosed:
+                    return
+                dt = time.perf_counter() - start
+
+                self.sent += 1
+                self.send_time += dt
+                self.max_send_time = max(self.max_send_time, dt)
+                if self.metrics is not None:
+                    self.metrics.observe("send", dt)
+
+    def stats(self):
+        return {
+            "address": self.ws.remote_address,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "mean_send_time": self.send_time / max(self.sent, 1),
+            "max_send_time": self.max_send_time,
+        }
+
+
+# websocket server with a small pub/sub broker. every message is serialized
+# once by its publisher and handed to the broker, which fans it out to the
+# subscribers of its topic in a task of its own, so neither the receive loop nor
+# the pipeline waits on a loop over all clients. the last message of a topic is
+# retained and sent to clients subscribing later on, unless it was published
+# with retain=False like the messages relayed between clients.
+class WSServer:
+    def __init__(
+        self, host="0.0.0.0", port=6789, max_clients=32, metrics=None, on_control=None
+    ):
+        self.host = host
+        self.port = port
+        self.max_clients = max_clients
+        self.metrics = metrics
+
+        # called with the client and the decoded control message
+        self.on_control = on_control
+
+        self.clients = []
+        self.subscribers = {topic: [] for topic in TOPICS}
+        self.retained = {}
+
+        # (message, sender) per topic waiting to be fanned out, newer messages
+        # replace older ones like in WSClient. messages of fifo topics are
+        # queued in order as (topic, message, sender) instead.
+        self.pending = {}
+        self.queued = deque()
+        self.ready = asyncio.Event()
+
+    @asynccontextmanager
+    async def listen(self):
+        fanout = asyncio.create_task(self.fanout())
+        try:
+            async with serve(self.handler, self.host, self.port) as server:
+                yield server
+        finally:
+            fanout.cancel()
+
+    async def handler(self, ws):
+        if len(self.clients) >= self.max_clients:
+            await ws.close(1013, "too many clients")
+            return
+
+        topics = DEFAULT_TOPICS
+        query = parse_qs(urlsplit(ws.request.path).query, keep_blank_values=True)
+        if "topics" in query:
+            topics = query["topics"][0].split(",")
+
+        client = WSClient(ws, self.metrics)
+        self.clients.append(client)
+        self.subscribe(client, topics)
+        pump = asyncio.create_task(client.pump())
+        try:
+            async for message in ws:
+                # relayed messages are meant for the clients connected right
+                # now, one client's message is never replayed to later ones
+                if not self.control(client, message):
+                    self.publish("control", message, retain=False, sender=client)
+        except ConnectionClosed:
+            pass
+        finally:
+            self.clients.remove(client)
+            self.unsubscribe(client, TOPICS)
+            pump.cancel()
+
+    def control(self, client, message):
+        # returns whether the message was a control message
+        if not isinstance(message, str) or not message.startswith(CONTROL_PREFIX):
+            return False
+        try:
+            control = json.loads(message)
+        except ValueError:
+            return False
+
+        kind = control.get("control")
+        if kind in ("subscribe", "unsubscribe"):
+            topics = control.get("topics", ())
+            if isinstance(topics, list):
+                if kind == "subscribe":
+                    self.subscribe(client, topics)
+                else:
+                    self.unsubscribe(client, topics)
+        elif self.on_control is not None:
+            self.on_control(client, control)
+        else:
+            return False
+        return True
+
+    def subscribe(self, client, topics):
+        for topic in topics:
+            subscribers = self.subscribers.get(topic)
+            if subscribers is None or client in subscribers:
+                continue
+            subscribers.append(client)
+            if topic in self.retained:
+                client.push(topic, self.retained[topic], fifo=topic in FIFO_TOPICS)
+
+    def unsubscribe(self, client, topics):
+        for topic in topics:
+            subscribers = self.subscribers.get(topic)
+            if subscribers is not None and client in subscribers:
+                subscribers.remove(client)
+
+    def publish(self, topic, message, retain=True, sender=None):
+        # queues message for the subscribers of topic except its sender
+        if topic in FIFO_TOPICS:
+            if len(self.queued) >= FANOUT_QUEUE_SIZE:
+                if self.metrics is not None:
+                    self.metrics.count("client_dropped")
+                return
+            self.queued.append((topic, message, sender))
+        else:
+            self.pending[topic] = (message, sender)
+        if retain:
+            self.retained[topic] = message
+        self.ready.set()
+
+    async def fanout(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+
+            pending, self.pending = self.pending, {}
+            for topic, (message, sender) in pending.items():
+                self.deliver(topic, message, sender)
+
+            queued, self.queued = self.queued, deque()
+            for topic, message, sender in queued:
+                self.deliver(topic, message, sender)
+
+    def deliver(self, topic, message, sender):
+        for client in self.subscribers[topic]:
+            if client is not sender:
+                client.push(topic, message, fifo=topic in FIFO_TOPICS)
+
+    def stats(self):
+        return [client.stats() for client in self.clients]
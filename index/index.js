@@ -1,145 +1,226 @@
-const { Live2DModel, ZipLoader } = PIXI.live2d;
-
-// register zip loading
-ZipLoader.zipReader = (data, url) => JSZip.loadAsync(data);
-ZipLoader.readText = (reader, path) => {
-  const file = reader.file(path);
-  return file.async("text");
+const { Live2DModel } = PIXI.live2d;
+
+// models are uploaded to the server once and loaded from their cached urls
+// after that, see hh/models.py
+const MODEL_STORAGE_KEY = "hoshihoshi.model";
+
+// binary tracking frames, see hh/protocol.py
+const WIRE_MAGIC = 0x6868; // "hh"
+const WIRE_VERSION = 2;
+const WIRE_HEADER_SIZE = 20;
+const WIRE_CHANNELS = [
+  ["head_rotation", "x"],
+  ["head_rotation", "y"],
+  ["head_rotation", "z"],
+  ["head_translation", "x"],
+  ["head_translation", "y"],
+  ["head_translation", "z"],
+  ["iris", "x"],
+  ["iris", "y"],
+  ["eye", "left"],
+  ["eye", "right"],
+  ["mouth", "x"],
+  ["mouth", "y"],
+];
+
+// decoded frames are written into the same object every time to avoid
+// allocating on every message
+const wireResult = {};
+for (const [group, key] of WIRE_CHANNELS) {
+  wireResult[group] = wireResult[group] || {};
+  wireResult[group][key] = 0.0;
+}
+
+const decodeFrame = (buffer) => {
+  const view = new DataView(buffer);
+  if (
+    view.getUint16(0, true) !== WIRE_MAGIC ||
+    view.getUint8(2) !== WIRE_VERSION
+  ) {
+    return null;
+  }
+
+  // the model follows the primary face, the first one in the frame. frames
+  // without any face keep the last result
+  const count = view.getUint8(3);
+  if (view.getUint8(4) === 0) return wireResult;
+  const values = new Float32Array(buffer, WIRE_HEADER_SIZE + 4, count);
+  for (let i = 0; i < Math.min(count, WIRE_CHANNELS.length); i++) {
+    const [group, key] = WIRE_CHANNELS[i];
+    wireResult[group][key] = values[i];
+  }
+  return wireResult;
 };
-ZipLoader.getFilePaths = (reader) => {
-  const paths = [];
-  reader.forEach((relPath) => paths.push(relPath));
-  return Promise.resolve(paths);
+
+const uploadModel = async (file) => {
+  const res = await fetch("/models?name=" + encodeURIComponent(file.name), {
+    method: "POST",
+    body: file,
+  });
+  if (!res.ok) throw new Error(await res.text());
+  return res.json();
 };
-ZipLoader.getFiles = (reader, paths) =>
-  Promise.all(paths.map(async (path) => {
-    const name = path.slice(path.lastIndexOf("/") + 1);
-    const blob = await reader.file(path).async("blob");
-    return new File([blob], name);
-  }));
 
-document.getElementById("zippicker").addEventListener(
-  "change",
-  async (event) => {
-    const files = event.target.files;
-    if (!files.length) return;
+const listModels = async () => {
+  const res = await fetch("/models.json");
+  return res.ok ? res.json() : [];
+};
 
-    // hide picker
-    document.getElementById("zp_container").style.display = "none";
-
-    // create pixi application
-    const app = new PIXI.Application({
-      view: document.getElementById("live2d"),
-      autoStart: true,
-      backgroundAlpha: 0,
-      backgroundColor: 0x00ff00,
-      resizeTo: window,
-    });
-
-    // load model
-    const model = await Live2DModel.from([files[0]], { autoInteract: false });
-    const core = model.internalModel.coreModel;
-    model.anchor.set(0.5, 0.5);
-    model.centerOffsetX = 1920 / 2;
-    model.centerOffsetY = 1080 / 2;
-    model.scaleOffset = 0.5;
-    model.interactive = true;
-
-    // render to rendertexture and sprite
-    const renderTexture = new PIXI.RenderTexture(
-      new PIXI.BaseRenderTexture(app.screen.width, app.screen.height),
+const startModel = async (meta) => {
+  localStorage.setItem(MODEL_STORAGE_KEY, meta.id);
+
+  // hide picker
+  document.getElementById("zp_container").style.display = "none";
+
+  // create pixi application
+  const app = new PIXI.Application({
+    view: document.getElementById("live2d"),
+    autoStart: true,
+    backgroundAlpha: 0,
+    backgroundColor: 0x00ff00,
+    resizeTo: window,
+  });
+
+  // load model
+  const model = await Live2DModel.from(meta.url, { autoInteract: false });
+  const core = model.internalModel.coreModel;
+  model.anchor.set(0.5, 0.5);
+  model.centerOffsetX = 1920 / 2;
+  model.centerOffsetY = 1080 / 2;
+  model.scaleOffset = 0.5;
+  model.interactive = true;
+
+  // render to rendertexture and sprite
+  const renderTexture = new PIXI.RenderTexture(
+    new PIXI.BaseRenderTexture(app.screen.width, app.screen.height),
+  );
+  const sprite = new PIXI.Sprite(renderTexture);
+  document.querySelector("#live2d").addEventListener("pointerdown", (e) => {
+    model.offsetX = e.x - model.centerOffsetX;
+    model.offsetY = e.y - model.centerOffsetY;
+    model.dragging = true;
+  });
+  document.querySelector("#live2d").addEventListener("pointerup", () => {
+    model.dragging = false;
+  });
+  document.querySelector("#live2d").addEventListener("pointermove", (e) => {
+    if (model.dragging) {
+      model.centerOffsetX = e.x - model.offsetX;
+      model.centerOffsetY = e.y - model.offsetY;
+    }
+  });
+  document.querySelector("#live2d").addEventListener("wheel", (e) => {
+    e.preventDefault();
+    model.scaleOffset = model.scaleOffset - e.deltaY * -0.0001;
+  });
+
+  // render every tick
+  app.ticker.add(() => {
+    app.renderer.render(model, renderTexture);
+  });
+  app.stage.addChild(sprite);
+
+  // receive tracking data from websocket
+  const ws = new WebSocket("ws://" + window.location.hostname + ":6789");
+  ws.binaryType = "arraybuffer";
+  ws.onmessage = ({ data }) => {
+    const result = typeof data === "string"
+      ? JSON.parse(data)
+      : decodeFrame(data);
+    if (!result) return;
+
+    const scaled_translation_x = result.head_translation.x * 10;
+    const scaled_translation_y = result.head_translation.y * 10;
+    model.position.set(
+      scaled_translation_x + model.centerOffsetX,
+      scaled_translation_y + model.centerOffsetY,
+    );
+    const scaled_translation_z = 1.5 -
+      Math.min(Math.max(result.head_translation.z / 480, 0.0), 1.5 - 0.1);
+    model.scale.set(
+      scaled_translation_z - model.scaleOffset,
     );
-    const sprite = new PIXI.Sprite(renderTexture);
-    document.querySelector("#live2d").addEventListener("pointerdown", (e) => {
-      model.offsetX = e.x - model.centerOffsetX;
-      model.offsetY = e.y - model.centerOffsetY;
-      model.dragging = true;
-    });
-    document.querySelector("#live2d").addEventListener("pointerup", () => {
-      model.dragging = false;
-    });
-    document.querySelector("#live2d").addEventListener("pointermove", (e) => {
-      if (model.dragging) {
-        model.centerOffsetX = e.x - model.offsetX;
-        model.centerOffsetY = e.y - model.offsetY;
-      }
-    });
-    document.querySelector("#live2d").addEventListener("wheel", (e) => {
-      e.preventDefault();
-      model.scaleOffset = model.scaleOffset - e.deltaY * -0.0001;
-    });
-
-    // render every tick
-    app.ticker.add(() => {
-      app.renderer.render(model, renderTexture);
-    });
-    app.stage.addChild(sprite);
-
-    // receive tracking data from websocket
-    const ws = new WebSocket("ws://" + window.location.hostname + ":6789");
-    ws.onmessage = ({ data }) => {
-      const result = JSON.parse(data);
-
-      const scaled_translation_x = result.head_translation.x * 10;
-      const scaled_translation_y = result.head_translation.y * 10;
-      model.position.set(
-        scaled_translation_x + model.centerOffsetX,
-        scaled_translation_y + model.centerOffsetY,
+
+    model.internalModel.motionManager.update = () => {
+      model.internalModel.eyeBlink = undefined;
+
+      // core.setParamFloat("PARAM_ANGLE_X", result.head_rotation.y);
+      // core.setParamFloat("PARAM_ANGLE_Y", -result.head_rotation.x + 180);
+      // core.setParamFloat("PARAM_ANGLE_Z", -result.head_rotation.z);
+      //
+      // core.setParamFloat("PARAM_BODY_ANGLE_X", result.head_rotation.y * 0.3);
+      // core.setParamFloat("PARAM_BODY_ANGLE_Y", (-result.head_rotation.x + 180) * 0.3);
+      // core.setParamFloat("PARAM_BODY_ANGLE_Z", -result.head_rotation.z * 0.3);
+      //
+      // core.setParamFloat("PARAM_EYE_BALL_X", result.iris.x);
+      // core.setParamFloat("PARAM_EYE_BALL_Y", result.iris.y - 0.5);
+      //
+      // core.setParamFloat("PARAM_MOUTH_OPEN_Y", result.mouth.y);
+      // core.setParamFloat("PARAM_MOUTH_FORM", result.mouth.x);
+      //
+      // core.setParamFloat("PARAM_EYE_L_OPEN", result.eye.left);
+      // core.setParamFloat("PARAM_EYE_R_OPEN", result.eye.right);
+
+      core.setParameterValueById("ParamAngleX", result.head_rotation.y);
+      core.setParameterValueById("ParamAngleY", result.head_rotation.x);
+      core.setParameterValueById("ParamAngleZ", result.head_rotation.z);
+
+      core.setParameterValueById(
+        "ParamBodyAngleX",
+        result.head_rotation.y * 0.3,
+      );
+      core.setParameterValueById(
+        "ParamBodyAngleY",
+        (-result.head_rotation.x + 180) * 0.3,
       );
-      const scaled_translation_z = 1.5 -
-        Math.min(Math.max(result.head_translation.z / 480, 0.0), 1.5 - 0.1);
-      model.scale.set(
-        scaled_translation_z - model.scaleOffset,
+      core.setParameterValueById(
+        "ParamBodyAngleZ",
+        -result.head_rotation.z * 0.3,
       );
 
-      model.internalModel.motionManager.update = () => {
-        model.internalModel.eyeBlink = undefined;
-
-        // core.setParamFloat("PARAM_ANGLE_X", result.head_rotation.y);
-        // core.setParamFloat("PARAM_ANGLE_Y", -result.head_rotation.x + 180);
-        // core.setParamFloat("PARAM_ANGLE_Z", -result.head_rotation.z);
-        //
-        // core.setParamFloat("PARAM_BODY_ANGLE_X", result.head_rotation.y * 0.3);
-        // core.setParamFloat("PARAM_BODY_ANGLE_Y", (-result.head_rotation.x + 180) * 0.3);
-        // core.setParamFloat("PARAM_BODY_ANGLE_Z", -result.head_rotation.z * 0.3);
-        //
-        // core.setParamFloat("PARAM_EYE_BALL_X", result.iris.x);
-        // core.setParamFloat("PARAM_EYE_BALL_Y", result.iris.y - 0.5);
-        //
-        // core.setParamFloat("PARAM_MOUTH_OPEN_Y", result.mouth.y);
-        // core.setParamFloat("PARAM_MOUTH_FORM", result.mouth.x);
-        //
-        // core.setParamFloat("PARAM_EYE_L_OPEN", result.eye.left);
-        // core.setParamFloat("PARAM_EYE_R_OPEN", result.eye.right);
-
-        core.setParameterValueById("ParamAngleX", result.head_rotation.y);
-        core.setParameterValueById("ParamAngleY", result.head_rotation.x);
-        core.setParameterValueById("ParamAngleZ", result.head_rotation.z);
-
-        core.setParameterValueById(
-          "ParamBodyAngleX",
-          result.head_rotation.y * 0.3,
-        );
-        core.setParameterValueById(
-          "ParamBodyAngleY",
-          (-result.head_rotation.x + 180) * 0.3,
-        );
-        core.setParameterValueById(
-          "ParamBodyAngleZ",
-          -result.head_rotation.z * 0.3,
-        );
-
-        core.setParameterValueById("ParamEyeBallX", result.iris.x);
-        core.setParameterValueById("ParamEyeBallY", result.iris.y - 0.5);
-
-        core.setParameterValueById("ParamMouthOpenY", result.mouth.y);
-        core.setParameterValueById("ParamMouthForm", result.mouth.x);
-
-        core.setParameterValueById("ParamEyeLOpen", result.eye.left);
-        core.setParameterValueById("ParamEyeROpen", result.eye.right);
-
-        return true;
-      };
+      core.setParameterValueById("ParamEyeBallX", result.iris.x);
+      core.setParameterValueById("ParamEyeBallY", result.iris.y - 0.5);
+
+      core.setParameterValueById("ParamMouthOpenY", result.mouth.y);
+      core.setParameterValueById("ParamMouthForm", result.mouth.x);
+
+      core.setParameterValueById("ParamEyeLOpen", result.eye.left);
+      core.setParameterValueById("ParamEyeROpen", result.eye.right);
+
+      return true;
     };
+  };
+};
+
+document.getElementById("zippicker").addEventListener(
+  "change",
+  async (event) => {
+    const files = event.target.files;
+    if (!files.length) return;
+    startModel(await uploadModel(files[0]));
   },
 );
+
+// start right away with ?model=<id>, otherwise offer the cached models with
+// the last used one selected
+(async () => {
+  const models = await listModels();
+  const wanted = new URLSearchParams(window.location.search).get("model");
+  const meta = models.find((m) => m.id === wanted);
+  if (meta) {
+    startModel(meta);
+    return;
+  }
+
+  if (!models.length) return;
+  const picker = document.getElementById("modelpicker");
+  const last = localStorage.getItem(MODEL_STORAGE_KEY);
+  for (const m of models) {
+    picker.add(new Option(m.name, m.id, false, m.id === last));
+  }
+  document.getElementById("cached").style.display = "";
+  document.getElementById("modelstart").addEventListener("click", () => {
+    const meta = models.find((m) => m.id === picker.value);
+    if (meta) startModel(meta);
+  });
+})();
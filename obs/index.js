@@ -1,4 +1,44 @@
-const ws = new WebSocket("ws://10.11.235.99:6789");
-ws.onmessage = ({ data }) => {
-    document.getElementById("render").src = data;
-};
\ No newline at end of file
+// shows the tracker preview on a canvas. the stream is set up with url
+// parameters, e.g. index.html?host=10.0.0.2&format=webp&width=480&fps=15
+const params = new URLSearchParams(window.location.search);
+const host = params.get("host") || window.location.hostname || "127.0.0.1";
+const request = {
+    control: "preview",
+    format: params.get("format") || "webp",
+    width: Number(params.get("width")) || 320,
+    fps: Number(params.get("fps")) || 15,
+};
+const mimeTypes = { jpeg: "image/jpeg", webp: "image/webp" };
+
+const canvas = document.getElementById("render");
+const ctx = canvas.getContext("2d");
+
+// only preview frames are wanted, not tracking frames
+const ws = new WebSocket("ws://" + host + ":6789/?topics=preview");
+ws.binaryType = "arraybuffer";
+ws.onopen = () => {
+    ws.send(JSON.stringify(request));
+};
+ws.onmessage = async ({ data }) => {
+    // skip anything that is not a preview frame, like tracking frames from a
+    // server without topics
+    if (typeof data === "string") return;
+    const head = new Uint8Array(data, 0, 2);
+    if (head[0] === 0x68 && head[1] === 0x68) return;
+
+    // the server only sends the next frame once this one is acked, so frames
+    // are skipped instead of piling up while decoding falls behind
+    try {
+        const bitmap = await createImageBitmap(
+            new Blob([data], { type: mimeTypes[request.format] }),
+        );
+        if (canvas.width !== bitmap.width || canvas.height !== bitmap.height) {
+            canvas.width = bitmap.width;
+            canvas.height = bitmap.height;
+        }
+        ctx.drawImage(bitmap, 0, 0);
+        bitmap.close();
+    } finally {
+        ws.send('{"control":"ack"}');
+    }
+};
@@ -6,5 +6,6 @@ setup(
     name="hoshihoshi",
     version="01.0",
     packages=find_packages(),
+    package_data={"hh": ["*.npy"]},
     scripts=["hoshihoshi"],
 )
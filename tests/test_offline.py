@@ -0,0 +1,72 @@
+import cv2
+import numpy as np
+import pytest
+
+import hh.offline
+
+
+@pytest.fixture
+def clip(tmp_path):
+    # a short mp4v clip with a keyframe only every 12 frames, so chunks start
+    # between keyframes, and a frame counter drawn into every frame
+    path = str(tmp_path / "clip.mp4")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 30, (64, 48))
+    if not writer.isOpened():
+        pytest.skip("no mp4v encoder")
+    writer.set(cv2.VIDEOWRITER_PROP_QUALITY, 100)
+    for i in range(45):
+        frame = np.zeros((48, 64, 3), dtype=np.uint8)
+        cv2.putText(frame, str(i), (2, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (255,) * 3)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def read_all(path):
+    cap = cv2.VideoCapture(path)
+    frames = [f for _, f in hh.offline.read_chunk(cap, 0, None)]
+    cap.release()
+    return frames
+
+
+def test_chunks_match_sequential_read(clip):
+    sequential = read_all(clip)
+    frames, _, _ = hh.offline.video_info(clip)
+    assert frames == len(sequential)
+
+    chunked = []
+    for start, stop in hh.offline.chunks(frames, 7):
+        cap = hh.offline.open_at(clip, start)
+        for i, f in hh.offline.read_chunk(cap, start, stop):
+            assert i == len(chunked)
+            chunked.append(f)
+        cap.release()
+
+    assert len(chunked) == len(sequential)
+    for i, (a, b) in enumerate(zip(chunked, sequential)):
+        assert np.array_equal(a, b), f"frame {i} differs"
+
+
+def test_open_at_recovers_from_an_overshooting_seek(clip, monkeypatch):
+    sequential = read_all(clip)
+    VideoCapture = cv2.VideoCapture
+
+    # a backend that lands past the frame that was asked for
+    class Overshooting:
+        def __init__(self, path):
+            self.cap = VideoCapture(path)
+
+        def set(self, prop, value):
+            if prop == cv2.CAP_PROP_POS_FRAMES:
+                value += 3
+            return self.cap.set(prop, value)
+
+        def __getattr__(self, name):
+            return getattr(self.cap, name)
+
+    monkeypatch.setattr(hh.offline.cv2, "VideoCapture", Overshooting)
+    cap = hh.offline.open_at(clip, 20)
+    i, f = next(hh.offline.read_chunk(cap, 20, None))
+    cap.release()
+    assert i == 20
+    assert np.array_equal(f, sequential[20])